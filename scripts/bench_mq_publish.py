@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import json
+import threading
+import pika
+
+# Publish-throughput benchmark for movies-service payment requests: the old path
+# (connect + declare + publish + close per message) vs mq_publisher.Publisher
+# (pooled channels with publisher confirms, and batched publishes).
+#
+# Runs against a local broker on a scratch queue (deleted at the end):
+#   RABBITMQ_HOST=localhost python scripts/bench_mq_publish.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "movies-service"))
+from mq_publisher import Publisher, PERSISTENT
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+QUEUE = os.getenv("MQ_BENCH_QUEUE", "bench_payment_requests")
+MESSAGES = int(os.getenv("MQ_BENCH_MESSAGES", "2000"))
+THREADS = int(os.getenv("MQ_BENCH_THREADS", "8"))
+BATCH = 100
+
+PAYLOAD = json.dumps({
+    "reservation_id": 1, "reservation_ids": [1], "user_id": "bench",
+    "amount": 15.0, "currency": "EUR"
+})
+
+def params():
+    return pika.ConnectionParameters(host=RABBITMQ_HOST)
+
+def declare(channel):
+    channel.queue_declare(queue=QUEUE, durable=True)
+
+def legacy_publish():
+    connection = pika.BlockingConnection(params())
+    channel = connection.channel()
+    declare(channel)
+    channel.basic_publish(exchange='', routing_key=QUEUE, body=PAYLOAD, properties=PERSISTENT)
+    connection.close()
+
+def run_threads(label, count, work):
+    # work(n) publishes n messages; the total is split over THREADS threads
+    per_thread = count // THREADS
+    threads = [threading.Thread(target=work, args=(per_thread,)) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = per_thread * THREADS
+    print(f"{label:<34} {total:>6} msgs {elapsed:>8.2f} s {total / elapsed:>10,.0f} msg/s")
+
+def main():
+    print(f"RabbitMQ {RABBITMQ_HOST}, queue={QUEUE}, {THREADS} threads")
+
+    # The old path is slow enough that a tenth of the messages makes the point
+    run_threads("legacy (connection per message)", MESSAGES // 10,
+                lambda n: [legacy_publish() for _ in range(n)])
+
+    publisher = Publisher(params, pool_size=THREADS, declare=declare)
+    publisher.warm_up()
+    run_threads("pooled, confirm per message", MESSAGES,
+                lambda n: [publisher.publish('', QUEUE, PAYLOAD) for _ in range(n)])
+
+    def batched(n):
+        for i in range(0, n, BATCH):
+            publisher.publish_batch('', QUEUE, [PAYLOAD] * min(BATCH, n - i))
+    run_threads(f"pooled, batches of {BATCH}", MESSAGES, batched)
+    publisher.close()
+
+    connection = pika.BlockingConnection(params())
+    connection.channel().queue_delete(queue=QUEUE)
+    connection.close()
+
+if __name__ == "__main__":
+    main()
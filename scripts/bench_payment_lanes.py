@@ -0,0 +1,80 @@
+import os
+import sys
+import heapq
+import random
+from collections import deque
+
+# Latency of urgent payment requests (show starting soon) under a saturated request
+# queue: one FIFO queue vs the weighted lanes of payment-service/lanes.py.
+# Discrete-event simulation of one worker, no broker needed:
+#   python scripts/bench_payment_lanes.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "payment-service"))
+from lanes import LaneScheduler
+
+CONCURRENCY = 8 # PAYMENT_CONCURRENCY
+CHARGE_SECONDS = 0.2 # mean Stripe latency
+ARRIVALS_PER_SECOND = 50 # capacity is CONCURRENCY / CHARGE_SECONDS = 40/s
+DURATION = 120 # seconds of arrivals
+BACKLOG = 2000 # requests already queued at t=0 (e.g. after an outage)
+MIX = [("urgent", 0.05), ("normal", 0.65), ("later", 0.30)]
+WEIGHTS = {"urgent": 8, "normal": 3, "later": 1} # PAYMENT_LANE_WEIGHTS
+
+def make_arrivals(rng):
+    lanes, shares = zip(*MIX)
+    arrivals = [(0.0, rng.choices(lanes, shares)[0]) for _ in range(BACKLOG)]
+    t = 0.0
+    while t < DURATION:
+        t += rng.expovariate(ARRIVALS_PER_SECOND)
+        arrivals.append((t, rng.choices(lanes, shares)[0]))
+    return arrivals
+
+class Fifo:
+    def __init__(self):
+        self._items = deque()
+
+    def push(self, lane, item):
+        self._items.append((lane, item))
+
+    def pop(self):
+        return self._items.popleft() if self._items else None
+
+def simulate(arrivals, queue, rng):
+    latencies = {lane: [] for lane, _ in MIX}
+    free_at = [0.0] * CONCURRENCY # heap of times each charge slot frees up
+    i = 0
+    while True:
+        now = heapq.heappop(free_at)
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            queue.push(arrivals[i][1], arrivals[i][0])
+            i += 1
+        picked = queue.pop()
+        if picked is None:
+            if i == len(arrivals):
+                break
+            # Idle slot: wake it at the next arrival
+            heapq.heappush(free_at, arrivals[i][0])
+            continue
+        lane, arrived = picked
+        done = now + rng.expovariate(1 / CHARGE_SECONDS)
+        latencies[lane].append(done - arrived)
+        heapq.heappush(free_at, done)
+    return latencies
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    arrivals = make_arrivals(random.Random(42))
+    print(f"{len(arrivals)} requests ({BACKLOG} backlog), {ARRIVALS_PER_SECOND}/s arriving vs "
+          f"{CONCURRENCY / CHARGE_SECONDS:.0f}/s capacity, weights {WEIGHTS}")
+    print(f"{'queue':<6} | {'lane':<7} | {'served':>6} | {'p50 s':>8} | {'p99 s':>8} | {'max s':>8}")
+    for name, queue in (("fifo", Fifo()), ("lanes", LaneScheduler(WEIGHTS))):
+        latencies = simulate(arrivals, queue, random.Random(7))
+        for lane, values in latencies.items():
+            print(f"{name:<6} | {lane:<7} | {len(values):>6} | {pct(values, 0.5):>8.2f} | "
+                  f"{pct(values, 0.99):>8.2f} | {max(values):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Charge throughput of payment-service/payment_worker.py at different PAYMENT_CONCURRENCY
+# levels, calling charge() directly (no broker) against a local stripe-mock:
+#   docker run --rm -p 12111:12111 stripe/stripe-mock
+#   STRIPE_API_BASE=http://localhost:12111 python scripts/bench_payment_worker.py
+
+LEVELS = [1, 4, 8, 16, 32]
+CHARGES = int(os.getenv("BENCH_CHARGES", "400"))
+
+for name, value in {
+    "RABBITMQ_HOST": "localhost",
+    "MQ_QUEUE_REQUESTS": "payment_requests",
+    "MQ_EXCHANGE_EVENTS": "payment_events",
+    "STRIPE_API_KEY": "sk_test_123",
+    "STRIPE_API_BASE": "http://localhost:12111",
+    # Required at import; charge() never talks to Redis, so no server is needed
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    # The shared HTTP pool has to fit the widest level
+    "PAYMENT_CONCURRENCY": str(max(LEVELS)),
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "payment-service"))
+import payment_worker
+
+def payload(i):
+    return {"reservation_id": f"bench-{i}", "user_id": "bench", "amount": 1500, "currency": "usd"}
+
+def main():
+    print(f"stripe-mock at {os.environ['STRIPE_API_BASE']}, {CHARGES} charges per level")
+    payment_worker.charge(payload(-1)) # warm the connection pool
+
+    base = None
+    for level in LEVELS:
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            start = time.perf_counter()
+            events = list(pool.map(payment_worker.charge, (payload(i) for i in range(CHARGES))))
+            elapsed = time.perf_counter() - start
+
+        failed = sum(1 for e in events if e["status"] != "PAID")
+        rate = CHARGES / elapsed
+        base = base or rate
+        print(f"concurrency {level:>3}: {rate:>8,.0f} charges/s  x{rate / base:>5.1f}  failed={failed}")
+
+if __name__ == "__main__":
+    main()
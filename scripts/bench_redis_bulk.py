@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import uuid
+import redis
+
+# Benchmark for the bulk read layer in movies-service/redis_client.py.
+# Compares the old "SMEMBERS + one GET per member" listing with get_all_members()
+# (chunked MGETs in one pipeline) and reports round trips and latency.
+#
+# Runs against a local Redis on a scratch DB (flushed on start!):
+#   REDIS_HOST=localhost REDIS_PORT=6379 REDIS_BENCH_DB=15 python scripts/bench_redis_bulk.py
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_BENCH_DB = int(os.getenv("REDIS_BENCH_DB", "15"))
+SIZES = [10, 1_000, 50_000]
+REPEATS = 5
+
+# redis_client imports utils, which insists on the service env being present
+for name, value in {
+    "KEYCLOAK_URL_INTERNAL": "http://localhost:8180",
+    "KEYCLOAK_REALM": "bench",
+    "KEYCLOAK_CLIENT_ID": "bench",
+    "REDIS_HOST": REDIS_HOST,
+    "REDIS_PORT": str(REDIS_PORT),
+    "RABBITMQ_HOST": "localhost",
+    "DATABASE_URL": "sqlite://",
+    "PORT": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "movies-service"))
+import redis_client
+
+# Every round trip (single command or whole pipeline) is one send_packed_command call
+ROUND_TRIPS = 0
+_send_packed_command = redis.connection.Connection.send_packed_command
+
+def _counting_send(self, *args, **kwargs):
+    global ROUND_TRIPS
+    ROUND_TRIPS += 1
+    return _send_packed_command(self, *args, **kwargs)
+
+redis.connection.Connection.send_packed_command = _counting_send
+
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_BENCH_DB, decode_responses=True)
+redis_client.r = r
+
+def populate(n):
+    r.flushdb()
+    pipe = r.pipeline(transaction=False)
+    for i in range(n):
+        mid = str(uuid.uuid4())
+        pipe.set(f"{redis_client.PREFIX_MOVIE}:{mid}", json.dumps({
+            "id": mid, "title": f"Movie {i}", "description": "x" * 200, "duration": 120
+        }))
+        pipe.sadd(redis_client.SET_MOVIES, mid)
+        if len(pipe) >= 10_000:
+            pipe.execute()
+    pipe.execute()
+
+def legacy_get_all_movies():
+    movies = []
+    for mid in r.smembers(redis_client.SET_MOVIES):
+        data = r.get(f"{redis_client.PREFIX_MOVIE}:{mid}")
+        if data:
+            movies.append(json.loads(data))
+    return movies
+
+def measure(fn):
+    global ROUND_TRIPS
+    timings = []
+    for _ in range(REPEATS):
+        ROUND_TRIPS = 0
+        start = time.perf_counter()
+        items = fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return len(items), ROUND_TRIPS, timings[len(timings) // 2]
+
+def main():
+    print(f"Redis {REDIS_HOST}:{REDIS_PORT} db={REDIS_BENCH_DB}, MGET chunk={redis_client.MGET_CHUNK_SIZE}")
+    print(f"{'keys':>8} | {'variant':<8} | {'round trips':>11} | {'median ms':>10}")
+    for n in SIZES:
+        populate(n)
+        for name, fn in (("legacy", legacy_get_all_movies), ("bulk", redis_client.get_all_movies)):
+            count, trips, median = measure(fn)
+            assert count == n, f"{name} returned {count} of {n}"
+            print(f"{n:>8} | {name:<8} | {trips:>11} | {median * 1000:>10.2f}")
+    r.flushdb()
+
+if __name__ == "__main__":
+    main()
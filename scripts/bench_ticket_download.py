@@ -0,0 +1,99 @@
+import os
+import sys
+import logging
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+
+# Ticket download throughput under concurrent clients against ticket-service's
+# /tickets route (threaded werkzeug server, in process):
+#   full        plain GET, the whole PDF every time
+#   revalidate  If-None-Match with the ETag from the first download -> 304
+#   range       first KB only -> 206
+#   x-accel     TICKET_SENDFILE_MODE=x-accel: the app only answers headers, the
+#               bytes would come from the front proxy
+# Runs offline:
+#   python scripts/bench_ticket_download.py
+
+DIRECTORY = tempfile.mkdtemp(prefix="bench_download_")
+for name, value in {
+    "RABBITMQ_HOST": "localhost",
+    "MQ_EXCHANGE_EVENTS": "payment_events",
+    "TICKETS_DIR": DIRECTORY,
+    # Throwaway key: ticket_service refuses to start without one
+    "TICKET_SIGNING_KEY": "bench-signing-key",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "ticket-service"))
+import ticket_service
+from ticket_render import render_ticket, render_order
+from ticket_store import save_event, pdf_path, order_pdf_path
+
+TICKETS = 50
+LEVELS = [1, 8, 32]
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "2000"))
+PORT = int(os.getenv("BENCH_PORT", "5093"))
+
+def ticket(i):
+    return {"reservation_id": f"00000000-0000-0000-0000-{i:012d}", "user_id": "bench", "status": "PAID"}
+
+def prepare():
+    # Real ticket PDFs plus one 8-seat order, so downloads are not all the same tiny file
+    names = []
+    for i in range(TICKETS):
+        data = ticket(i)
+        save_event(data)
+        render_ticket(data, pdf_path(data["reservation_id"]))
+        names.append(f"ticket_{data['reservation_id']}.pdf")
+    order = [ticket(i) for i in range(8)]
+    render_order(order, order_pdf_path(order[0]["reservation_id"]))
+    names.append(f"order_{order[0]['reservation_id']}.pdf")
+    return names
+
+def run(label, names, level, headers_for):
+    local = threading.local()
+
+    def fetch(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        name = names[i % len(names)]
+        r = session.get(f"http://127.0.0.1:{PORT}/tickets/{name}", headers=headers_for(name))
+        return r.status_code, len(r.content)
+
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(fetch, range(REQUESTS)))
+        elapsed = time.perf_counter() - start
+
+    statuses = sorted({status for status, _ in results})
+    sent = sum(size for _, size in results)
+    print(f"{label:<11} | {level:>5} | {REQUESTS / elapsed:>9,.0f} | {sent / elapsed / 1e6:>8.2f} | {statuses}")
+
+def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) # no access log per request
+    names = prepare()
+    server = make_server("127.0.0.1", PORT, ticket_service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        etags = {name: requests.get(f"http://127.0.0.1:{PORT}/tickets/{name}").headers["ETag"] for name in names}
+        print(f"{len(names)} PDFs, {REQUESTS} requests per run")
+        print(f"{'mode':<11} | {'conc':>5} | {'req/s':>9} | {'MB/s':>8} | statuses")
+        for level in LEVELS:
+            run("full", names, level, lambda name: {})
+            run("revalidate", names, level, lambda name: {"If-None-Match": etags[name]})
+            run("range", names, level, lambda name: {"Range": "bytes=0-1023"})
+            ticket_service.TICKET_SENDFILE_MODE = "x-accel"
+            run("x-accel", names, level, lambda name: {})
+            ticket_service.TICKET_SENDFILE_MODE = ""
+    finally:
+        server.shutdown()
+        shutil.rmtree(DIRECTORY)
+
+if __name__ == "__main__":
+    main()
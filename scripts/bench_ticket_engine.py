@@ -0,0 +1,109 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# CPU time and bytes written per ticket for each ticket PDF engine:
+#   legacy      QR saved to a temp PNG, read back by reportlab, deleted
+#   bitmap      QR image passed to reportlab from memory (the previous ticket_render)
+#   overlay     ticket_render: shared template form + vector QR, one PDF per ticket
+#   overlay x N ticket_render.render_order: one multi-page PDF per order of N seats
+# Runs offline, single process:
+#   python scripts/bench_ticket_engine.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "ticket-service"))
+import qrcode
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from ticket_render import render_ticket, render_order, write_durably
+
+TICKETS = int(os.getenv("BENCH_TICKETS", "200"))
+ORDER_SIZES = [2, 4, 8]
+
+def ticket(i):
+    return {"reservation_id": f"00000000-0000-0000-0000-{i:012d}", "user_id": "bench", "status": "PAID"}
+
+def legacy_engine(tickets, directory):
+    written = 0
+    for data in tickets:
+        res_id = data["reservation_id"]
+        path = os.path.join(directory, f"ticket_{res_id}.pdf")
+        c = canvas.Canvas(path)
+        c.drawString(100, 800, "CINEMA TICKET")
+        c.drawString(100, 780, f"Reservation ID: {res_id}")
+        c.drawString(100, 760, f"User ID: {data.get('user_id')}")
+        c.drawString(100, 740, "Status: PAID")
+        qr_path = os.path.join(directory, f"qr_{res_id}.png")
+        qrcode.make(res_id).save(qr_path)
+        written += os.path.getsize(qr_path)
+        c.drawImage(qr_path, 100, 500, width=100, height=100)
+        c.save()
+        os.remove(qr_path)
+        written += os.path.getsize(path)
+    return written
+
+def bitmap_engine(tickets, directory):
+    written = 0
+    for data in tickets:
+        res_id = data["reservation_id"]
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf)
+        c.drawString(100, 800, "CINEMA TICKET")
+        c.drawString(100, 780, f"Reservation ID: {res_id}")
+        c.drawString(100, 760, f"User ID: {data.get('user_id')}")
+        c.drawString(100, 740, "Status: PAID")
+        c.drawImage(ImageReader(qrcode.make(res_id).get_image()), 100, 500, width=100, height=100)
+        c.save()
+        path = os.path.join(directory, f"ticket_{res_id}.pdf")
+        write_durably(path, buf.getvalue())
+        written += os.path.getsize(path)
+    return written
+
+def overlay_engine(tickets, directory):
+    written = 0
+    for data in tickets:
+        path = render_ticket(data, os.path.join(directory, f"ticket_{data['reservation_id']}.pdf"))
+        written += os.path.getsize(path)
+    return written
+
+def order_engine(size):
+    def run(tickets, directory):
+        written = 0
+        for start in range(0, len(tickets), size):
+            order = tickets[start:start + size]
+            path = render_order(order, os.path.join(directory, f"order_{order[0]['reservation_id']}.pdf"))
+            written += os.path.getsize(path)
+        return written
+    return run
+
+def measure(label, engine, directory, base):
+    tickets = [ticket(i) for i in range(TICKETS)]
+    engine(tickets[:2], directory) # warm up imports and font metrics
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    written = engine(tickets, directory)
+    cpu = (time.process_time() - cpu) / TICKETS * 1000
+    wall = (time.perf_counter() - wall) / TICKETS * 1000
+    per_ticket = written / TICKETS
+    base = base or (cpu, per_ticket)
+    print(f"{label:<16} | {cpu:>9.2f} | {wall:>9.2f} | {per_ticket:>10,.0f} | "
+          f"x{base[0] / cpu:>5.1f} cpu | x{base[1] / per_ticket:>5.1f} bytes")
+    return base
+
+def main():
+    directory = tempfile.mkdtemp(prefix="bench_engine_")
+    try:
+        print(f"{TICKETS} tickets, output in {directory}")
+        print(f"{'engine':<16} | {'cpu ms/t':>9} | {'wall ms/t':>9} | {'bytes/t':>10} | vs legacy")
+        base = measure("legacy", legacy_engine, directory, None)
+        measure("bitmap", bitmap_engine, directory, base)
+        measure("overlay", overlay_engine, directory, base)
+        for size in ORDER_SIZES:
+            measure(f"overlay x{size}", order_engine(size), directory, base)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Ticket PDF throughput: the old path (QR saved to a temp PNG, read back by reportlab,
+# deleted) vs ticket_render (QR from memory, atomic fsynced write), in one process and
+# on a process pool. Runs offline:
+#   python scripts/bench_ticket_render.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "ticket-service"))
+import qrcode
+from reportlab.pdfgen import canvas
+from ticket_render import render_ticket
+
+TICKETS = int(os.getenv("BENCH_TICKETS", "200"))
+
+def path_for(directory, i):
+    return os.path.join(directory, f"ticket_{i}.pdf")
+
+def new_ticket(data, directory):
+    render_ticket(data, os.path.join(directory, f"ticket_{data['reservation_id']}.pdf"))
+
+def ticket(i):
+    return {"reservation_id": f"00000000-0000-0000-0000-{i:012d}", "user_id": "bench", "status": "PAID"}
+
+def legacy_ticket(data, directory):
+    res_id = data["reservation_id"]
+    c = canvas.Canvas(os.path.join(directory, f"ticket_{res_id}.pdf"))
+    c.drawString(100, 800, "CINEMA TICKET")
+    c.drawString(100, 780, f"Reservation ID: {res_id}")
+    c.drawString(100, 760, f"User ID: {data.get('user_id')}")
+    c.drawString(100, 740, "Status: PAID")
+    qr_path = os.path.join(directory, f"qr_{res_id}.png")
+    qrcode.make(res_id).save(qr_path)
+    c.drawImage(qr_path, 100, 500, width=100, height=100)
+    c.save()
+    os.remove(qr_path)
+
+def run_serial(label, fn, directory):
+    start = time.perf_counter()
+    for i in range(TICKETS):
+        fn(ticket(i), directory)
+    rate = TICKETS / (time.perf_counter() - start)
+    print(f"{label:<32} {rate:>8.1f} tickets/s")
+    return rate
+
+def run_pool(workers, directory):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(render_ticket, [ticket(-1)] * workers, [path_for(directory, -1)] * workers)) # warm up workers
+        start = time.perf_counter()
+        list(pool.map(render_ticket, [ticket(i) for i in range(TICKETS)],
+                      [path_for(directory, i) for i in range(TICKETS)], chunksize=4))
+        rate = TICKETS / (time.perf_counter() - start)
+    print(f"{f'pool, {workers} processes':<32} {rate:>8.1f} tickets/s  ({rate / workers:.1f} per core)")
+
+def main():
+    directory = tempfile.mkdtemp(prefix="bench_tickets_")
+    try:
+        print(f"{TICKETS} tickets, {os.cpu_count()} cores, output in {directory}")
+        run_serial("legacy (temp PNG)", legacy_ticket, directory)
+        run_serial("in-memory QR, 1 process", new_ticket, directory)
+        for workers in sorted({2, 4, os.cpu_count() or 1}):
+            run_pool(workers, directory)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import uuid
+
+# Entry-scan throughput: HMAC verification of signed ticket codes (offline), then
+# admitting them on the admitted:{screening_id} bitmap, one scan per round trip (/scan)
+# vs batched (/scan/batch). The Redis part needs a server:
+#   docker run --rm -p 6379:6379 redis:7-alpine
+#   python scripts/bench_ticket_scan.py
+
+SCANS = int(os.getenv("BENCH_SCANS", "20000"))
+BATCH = int(os.getenv("BENCH_SCAN_BATCH", "500"))
+KEY = b"bench-signing-key"
+
+for name, value in {
+    "KEYCLOAK_URL_INTERNAL": "http://localhost:8080",
+    "KEYCLOAK_REALM": "bench",
+    "KEYCLOAK_CLIENT_ID": "bench",
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": "6379",
+    "RABBITMQ_HOST": "localhost",
+    "DATABASE_URL": "sqlite://",
+    "PORT": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "movies-service"))
+import redis
+import redis_client
+from ticket_codes import sign_ticket_code, verify_ticket_code
+
+def rate(label, count, fn):
+    start = time.perf_counter()
+    fn()
+    per_second = count / (time.perf_counter() - start)
+    print(f"{label:<28} {per_second:>10,.0f} scans/s")
+
+def main():
+    sid = str(uuid.uuid4())
+    codes = [sign_ticket_code(KEY, str(uuid.uuid4()), sid, i) for i in range(SCANS)]
+    print(f"{SCANS} codes, {len(codes[0])} chars each")
+
+    rate("sign", SCANS, lambda: [sign_ticket_code(KEY, "r", sid, i) for i in range(SCANS)])
+    tickets = []
+    rate("verify", SCANS, lambda: tickets.extend(verify_ticket_code(code, [KEY]) for code in codes))
+    assert all(tickets)
+    # A rotated key is tried after the current one fails
+    rate("verify, previous key", SCANS, lambda: [verify_ticket_code(code, [b"new-key", KEY]) for code in codes])
+
+    try:
+        redis_client.r.ping()
+    except redis.exceptions.ConnectionError:
+        print(f"no Redis at {os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}, skipping the admit runs")
+        return
+
+    key = f"{redis_client.PREFIX_ADMITTED}:{sid}"
+    scans = [(t.screening_id, t.seat_offset) for t in tickets]
+    try:
+        rate("admit, 1 per round trip", SCANS, lambda: [redis_client.admit_seats([scan]) for scan in scans])
+        redis_client.r.delete(key)
+        rate(f"admit, batches of {BATCH}", SCANS,
+             lambda: [redis_client.admit_seats(scans[i:i + BATCH]) for i in range(0, SCANS, BATCH)])
+        assert redis_client.r.bitcount(key) == SCANS
+    finally:
+        redis_client.r.delete(key)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import json
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# Microbenchmark for decode_and_verify_access_token: the old path (scan the JWKS,
+# rebuild the RSA key, full RS256 verify on every call) vs token_verifier.TokenVerifier.
+# Runs offline with a locally generated key set:
+#   python scripts/bench_token_verify.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "movies-service"))
+from token_verifier import TokenVerifier
+
+DURATION = 2.0 # seconds per variant
+USERS = 200 # distinct tokens in the rotation
+
+def make_jwks(count=3):
+    # Keycloak publishes a few keys; the signing one is last to make the old scan pay for it
+    keys, private = [], None
+    for i in range(count):
+        private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private.public_key()))
+        jwk.update({"kid": f"kid-{i}", "alg": "RS256", "use": "sig"})
+        keys.append(jwk)
+    return {"keys": keys}, private, keys[-1]["kid"]
+
+def make_tokens(private, kid, count):
+    now = int(time.time())
+    return [
+        jwt.encode({"sub": f"user-{i}", "exp": now + 3600, "iat": now,
+                    "realm_access": {"roles": ["viewer"]}},
+                   private, algorithm="RS256", headers={"kid": kid})
+        for i in range(count)
+    ]
+
+def legacy_verify(jwks, access_token):
+    kid = jwt.get_unverified_header(access_token).get("kid")
+    key = None
+    for jwk in jwks.get("keys", []):
+        if jwk.get("kid") == kid:
+            key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
+            break
+    return jwt.decode(access_token, key=key, algorithms=["RS256"],
+                      options={"verify_signature": True, "verify_exp": True, "verify_aud": False})
+
+def run(label, verify, tokens):
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        verify(tokens[done % len(tokens)])
+        done += 1
+    rate = done / (time.perf_counter() - start)
+    print(f"{label:<38} {rate:>12,.0f} verifications/s")
+    return rate
+
+def main():
+    jwks, private, kid = make_jwks()
+    tokens = make_tokens(private, kid, USERS)
+
+    base = run("legacy (scan + from_jwk + RS256)", lambda t: legacy_verify(jwks, t), tokens)
+
+    # Cold: the claims cache is too small to help, only parsed keys are reused
+    cold = TokenVerifier(lambda: jwks, max_tokens=1)
+    run_cold = run("TokenVerifier, key cache only", cold.verify, tokens)
+
+    # Warm: the usual case, each user sends the same token many times until it expires
+    warm = TokenVerifier(lambda: jwks)
+    for t in tokens:
+        warm.verify(t)
+    run_warm = run("TokenVerifier, warm claims cache", warm.verify, tokens)
+
+    print(f"\nspeedup: key cache x{run_cold / base:.1f}, claims cache x{run_warm / base:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -180,6 +180,77 @@ for r, c in seats_to_test:
     # Small sleep between tests just in case
     time.sleep(1)
 
+# MULTI-SEAT: overlapping blocks of 3 seats in one row, all contended at once
+def attempt_batch_booking(args):
+    username, access_token, screening_id, seats = args
+    url = f"{BASE_API}/reservations/batch"
+    payload = {
+        "screening_id": screening_id,
+        "seats": [{"row": r, "col": c} for r, c in seats]
+    }
+    headers = {"Authorization": f"Bearer {access_token}"}
+    try:
+        r = requests.post(url, json=payload, headers=headers)
+        return username, seats, r.status_code, r.text
+    except Exception as e:
+        return username, seats, 999, str(e)
+
+def run_multi_seat_test(seat_row, block_size=3, blocks=4, request_count=20):
+    print(f"\n{CYAN}[Test Multi-Seat Row {seat_row+1}] {blocks} overlapping blocks of {block_size} seats...{RESET}")
+
+    block_list = [[(seat_row, start + i) for i in range(block_size)] for start in range(blocks)]
+    user_cycle = itertools.cycle(USER_TOKENS)
+    block_cycle = itertools.cycle(block_list)
+    tasks = []
+    for _ in range(request_count):
+        u, t = next(user_cycle)
+        tasks.append((u, t, sid, next(block_cycle)))
+
+    won = []
+    others = 0
+    start_time = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [executor.submit(attempt_batch_booking, t) for t in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            u, seats, status, text = future.result()
+            label = ",".join(f"C{c+1}" for _, c in seats)
+            if status == 200:
+                won.append(seats)
+                print(f"  -> [{u}] {GREEN}SUCCESS (200){RESET} {label}")
+            elif status == 409:
+                print(f"  -> [{u}] {YELLOW}CONFLICT (409){RESET} {label}")
+            else:
+                others += 1
+                print(f"  -> [{u}] {RED}FAIL ({status}){RESET} {label}")
+
+    duration = time.time() - start_time
+    print(f"  Requests: {request_count} | {GREEN}Success: {len(won)}{RESET} | {RED}Error: {others}{RESET} | Time: {duration:.2f}s")
+
+    # No seat may be sold twice, and no order may be partially applied
+    sold = [seat for seats in won for seat in seats]
+    if len(sold) != len(set(sold)):
+        print(f"  {RED}>>> CRITICAL FAIL: overlapping orders both succeeded! <<< {RESET}")
+        return False
+    if not won:
+        print(f"  {RED}>>> FAIL: Zero orders succeeded. Row possibly already taken? <<< {RESET}")
+        return False
+
+    r = requests.get(f"{BASE_API}/movies/{mid}/screenings/{sid}/seats", headers=setup_headers)
+    layout = r.json()["data"]["layout"]
+    tested = {seat for block in block_list for seat in block}
+    taken = {(row, col) for row, col in tested if layout[row][col] == 1}
+    if taken != set(sold):
+        print(f"  {RED}>>> CRITICAL FAIL: seat map {sorted(taken)} != successful orders {sorted(sold)} <<< {RESET}")
+        return False
+
+    print(f"  {GREEN}>>> PASS: {len(won)} disjoint order(s), all-or-nothing. <<< {RESET}")
+    return True
+
+print(f"\n{CYAN}[4] Starting Multi-Seat Contention Test...{RESET}")
+if not run_multi_seat_test(2):
+    overall_pass = False
+
 print(f"\n{CYAN}--- Final Summary ---{RESET}")
 if overall_pass:
     print(f"{GREEN}ALL TESTS PASSED.{RESET}")
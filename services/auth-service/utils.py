@@ -1,8 +1,8 @@
 import os
 import time
 from typing import Any
-import jwt
 import requests
+from token_verifier import JwksManager, TokenVerifier
 
 def _get_env(name: str) -> str:
     value = os.getenv(name)
@@ -29,9 +29,11 @@ LOGOUT_URL = f"{KEYCLOAK_EXTERNAL}/realms/{REALM}/protocol/openid-connect/logout
 PORT = _get_env("PORT")
 
 JWKS_URL = f"{KEYCLOAK_INTERNAL}/realms/{REALM}/protocol/openid-connect/certs"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+JWKS_TTL = float(os.getenv("JWKS_TTL", "60"))
 
-_jwks_cache: dict[str, Any] | None = None
-_jwks_cache_expires_at: float = 0.0
+# Refreshed in the background; request threads never fetch it themselves
+_jwks = JwksManager(JWKS_URL, ttl=JWKS_TTL)
 
 def wait_for_keycloak():
     url = f"{KEYCLOAK_INTERNAL}/health/ready"
@@ -48,45 +50,8 @@ def wait_for_keycloak():
     raise RuntimeError("Keycloak not ready after 300 seconds")
 
 
-def _fetch_jwks() -> dict[str, Any]:
-    global _jwks_cache, _jwks_cache_expires_at
-
-    now = time.time()
-    if _jwks_cache and now < _jwks_cache_expires_at:
-        return _jwks_cache
-
-    resp = requests.get(JWKS_URL, timeout=10)
-    resp.raise_for_status()
-    _jwks_cache = resp.json()
-    _jwks_cache_expires_at = now + 60
-    return _jwks_cache
-
+# Parsed keys by kid + verified claims until exp, see token_verifier.py
+_verifier = TokenVerifier(_jwks.get, max_tokens=TOKEN_CACHE_SIZE, refresh_jwks=_jwks.force_refresh)
 
 def decode_and_verify_access_token(access_token: str) -> dict[str, Any]:
-    jwks = _fetch_jwks()
-    unverified_header = jwt.get_unverified_header(access_token)
-    kid = unverified_header.get("kid")
-    if not kid:
-        raise ValueError("JWT missing kid")
-
-    key = None
-    for jwk in jwks.get("keys", []):
-        if jwk.get("kid") == kid:
-            key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
-            break
-    if key is None:
-        raise ValueError("No matching JWK for kid")
-
-    options = {
-        "verify_signature": True,
-        "verify_exp": True,
-        "verify_aud": False,
-    }
-
-    kwargs: dict[str, Any] = {
-        "key": key,
-        "algorithms": ["RS256"],
-        "options": options,
-    }
-
-    return jwt.decode(access_token, **kwargs)
+    return _verifier.verify(access_token)
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import select, update
+import metrics
+from models import db, Reservation
+from redis_client import r, evict_past_screenings
+from seat_state import release_expired_seat_holds, free_reserved_seats, PENDING_STATUSES
+
+SCREENING_JANITOR_INTERVAL = int(os.getenv("SCREENING_JANITOR_INTERVAL", "60"))
+SEAT_HOLD_SWEEP_INTERVAL = int(os.getenv("SEAT_HOLD_SWEEP_INTERVAL", "10"))
+RESERVATION_SWEEP_INTERVAL = int(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+JANITOR_LOCK_KEY = "janitor:screenings"
+
+def run_screening_janitor_once():
+    # Every replica runs the loop; the lock makes sure only one of them sweeps per interval
+    if not r.set(JANITOR_LOCK_KEY, "1", nx=True, ex=max(SCREENING_JANITOR_INTERVAL - 1, 1)):
+        return 0
+
+    evicted = evict_past_screenings()
+    if evicted:
+        print(f" [Janitor] Evicted {evicted} past screenings")
+    return evicted
+
+def run_seat_hold_sweep_once():
+    # Holds whose booking never committed (crashed worker, lost request); safe to run on every replica
+    freed = release_expired_seat_holds()
+    if freed:
+        print(f" [Janitor] Freed {freed} seats from expired holds")
+    return freed
+
+def expire_pending_reservations(now=None, batch_size=RESERVATION_SWEEP_BATCH):
+    """Mark pending reservations past expires_at as EXPIRED and free their seats. Returns the count.
+
+    Seats are freed before the commit: if Redis fails the batch rolls back and the next
+    sweep retries it. The reverse order would lose the seats for good, since the next
+    UPDATE no longer matches rows already EXPIRED.
+    """
+    now = datetime.utcnow() if now is None else now
+    expired = 0
+    while True:
+        # Served by ix_reservation_status_expires; SKIP LOCKED lets replicas sweep side by side
+        batch = select(Reservation.id).where(
+            Reservation.status.in_(PENDING_STATUSES),
+            Reservation.expires_at < now
+        ).limit(batch_size).with_for_update(skip_locked=True)
+
+        rows = db.session.execute(
+            update(Reservation)
+            .where(Reservation.id.in_(batch))
+            .values(status="EXPIRED")
+            .returning(Reservation.screening_id, Reservation.room_number, Reservation.seat_row, Reservation.seat_column)
+            .execution_options(synchronize_session=False)
+        ).all()
+        try:
+            # A seat freed here for a commit that then fails is only a stale free bit:
+            # a booking claiming it hits the unique index and the bit is set again
+            free_reserved_seats(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        expired += len(rows)
+        if len(rows) < batch_size:
+            return expired
+
+def run_reservation_sweep_once():
+    reclaimed = expire_pending_reservations()
+    metrics.incr("reservation_sweeps_total")
+    metrics.incr("seats_reclaimed_total", reclaimed)
+    metrics.set_value("seats_reclaimed_last_run", reclaimed)
+    if reclaimed:
+        print(f" [Janitor] Expired {reclaimed} pending reservations")
+    return reclaimed
+
+def _run_every(interval, job):
+    def loop():
+        while True:
+            try:
+                job()
+            except Exception as e:
+                print(f" [Janitor] Error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
+def start_screening_janitor():
+    _run_every(SCREENING_JANITOR_INTERVAL, run_screening_janitor_once)
+    _run_every(SEAT_HOLD_SWEEP_INTERVAL, run_seat_hold_sweep_once)
+
+def start_reservation_sweeper(app):
+    def sweep():
+        with app.app_context():
+            run_reservation_sweep_once()
+
+    _run_every(RESERVATION_SWEEP_INTERVAL, sweep)
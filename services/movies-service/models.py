@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Integer, DateTime, ForeignKey, Index, text
+from sqlalchemy import String, Integer, Text, DateTime, ForeignKey, Index, text
 import uuid
 from typing import Optional
 from datetime import datetime
@@ -81,6 +81,10 @@ class Reservation(db.Model):
             unique=True,
             postgresql_where=text("status IN ('paid', 'pending', 'PAID', 'PENDING')")
         ),
+        # Expiry sweeper: pending rows past their hold deadline
+        Index('ix_reservation_status_expires', 'status', 'expires_at'),
+        # /reservations/me keyset pagination
+        Index('ix_reservation_user_created', 'user_id', 'created_at', 'id'),
     )
 
     def to_dict(self):
@@ -94,3 +98,24 @@ class Reservation(db.Model):
             "status": self.status,
             "screening_datetime": self.screening_datetime.isoformat()
         }
+
+# Messages to publish, written in the same transaction as the rows they describe
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    routing_key: Mapped[str] = mapped_column(String(255), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False) # JSON
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Relay scan: unsent rows in insertion order
+        Index('ix_outbox_unsent', 'id', postgresql_where=text("sent_at IS NULL")),
+    )
+
+def create_missing_indexes():
+    # create_all() skips tables that already exist, so add indexes introduced later
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
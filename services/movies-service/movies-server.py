@@ -3,13 +3,19 @@ import os
 from flask import Flask
 from dotenv import load_dotenv
 from utils import wait_for_keycloak
-from models import db
+from models import db, create_missing_indexes
 from routes import api
-from mq_utils import start_payment_result_listener
+from mq_utils import start_payment_publisher, start_payment_result_listener
+from redis_client import rebuild_screening_indexes
+from janitor import start_screening_janitor, start_reservation_sweeper
+from outbox import start_outbox_relay
+import metrics
 from utils import DATABASE_URL, PORT
 
 load_dotenv()
 
+RUN_PAYMENT_LISTENER = os.getenv("RUN_PAYMENT_LISTENER", "1") == "1"
+
 app = Flask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
@@ -24,17 +30,33 @@ app.register_blueprint(api)
 def health():
     return {"ok": True}
 
+@app.get("/metrics")
+def get_metrics():
+    return {"ok": True, "data": metrics.snapshot()}
+
 if __name__ == "__main__":
     wait_for_keycloak()
 
     with app.app_context():
         try:
             db.create_all()
+            create_missing_indexes()
         except Exception as e:
             print(f"DB creation error : {e}")
 
+    try:
+        print(f"Indexed {rebuild_screening_indexes()} cached screenings")
+    except Exception as e:
+        print(f"Redis index rebuild error : {e}")
+
     # Start RabbitMQ Listener
-    start_payment_result_listener(app)
+    start_payment_publisher()
+    start_outbox_relay(app)
+    # Off when the standalone payment_consumer.py handles payment results
+    if RUN_PAYMENT_LISTENER:
+        start_payment_result_listener(app)
+    start_screening_janitor()
+    start_reservation_sweeper(app)
 
     app.run(host="0.0.0.0", port=int(PORT), debug=True)
 
@@ -0,0 +1,138 @@
+import queue
+import threading
+from typing import Callable, Iterable
+import pika
+
+# Failures that mean the connection or channel is gone: drop it and retry on a fresh one
+RETRYABLE_ERRORS = (
+    pika.exceptions.AMQPConnectionError,
+    pika.exceptions.AMQPChannelError,
+    pika.exceptions.ConnectionWrongStateError,
+    pika.exceptions.ChannelWrongStateError,
+)
+
+PERSISTENT = pika.BasicProperties(delivery_mode=2)
+
+class _PooledChannel:
+    # pika's BlockingConnection is not thread-safe, so every pooled channel owns its connection
+    def __init__(self, parameters: pika.ConnectionParameters, declare: Callable):
+        self.connection = pika.BlockingConnection(parameters)
+        try:
+            self.channel = self.connection.channel()
+            declare(self.channel)
+            self.channel.confirm_delivery()
+        except Exception:
+            self.close()
+            raise
+
+    def alive(self) -> bool:
+        # An idle BlockingConnection services no heartbeats, so the broker may have dropped it
+        try:
+            self.connection.process_data_events(time_limit=0)
+        except Exception:
+            return False
+        return self.connection.is_open and self.channel.is_open
+
+    def publish(self, exchange: str, routing_key: str, body: str | bytes,
+                properties: pika.BasicProperties, mandatory: bool = False) -> None:
+        # Confirm mode: returns once the broker acked it, raises NackError/UnroutableError otherwise
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                   properties=properties, mandatory=mandatory)
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+class Publisher:
+    """Long-lived, thread-safe RabbitMQ publisher.
+
+    Keeps up to pool_size open channels with publisher confirms, so a publish is one
+    round trip instead of a connect/declare/close cycle. `declare` runs once per new
+    connection. Idle connections are checked on checkout; a lost connection is replaced
+    and the publish retried on a fresh one.
+    """
+
+    def __init__(self, parameters: Callable[[], pika.ConnectionParameters], pool_size: int = 4,
+                 declare: Callable | None = None, retries: int = 1):
+        self._parameters = parameters
+        self._declare = declare or (lambda channel: None)
+        self._retries = retries
+        self._idle: queue.LifoQueue[_PooledChannel] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _checkout(self, fresh: bool = False) -> _PooledChannel:
+        self._slots.acquire()
+        try:
+            while not fresh:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if pooled.alive():
+                    return pooled
+                pooled.close()
+            return _PooledChannel(self._parameters(), self._declare)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, pooled: _PooledChannel, broken: bool) -> None:
+        if broken:
+            pooled.close()
+        else:
+            self._idle.put(pooled)
+        self._slots.release()
+
+    def _run(self, action: Callable[[_PooledChannel], None]) -> None:
+        for attempt in range(self._retries + 1):
+            # Retries never take an idle connection: it is as old as the one that just failed
+            pooled = self._checkout(fresh=attempt > 0)
+            try:
+                action(pooled)
+            except RETRYABLE_ERRORS as e:
+                self._checkin(pooled, broken=True)
+                if attempt == self._retries:
+                    raise
+                print(f" [MQ] Publisher channel lost ({e!r}), reconnecting...")
+                continue
+            except BaseException:
+                self._checkin(pooled, broken=True)
+                raise
+            self._checkin(pooled, broken=False)
+            return
+
+    def warm_up(self) -> None:
+        """Open one connection now so the declares happen at startup, not on the first request."""
+        self._run(lambda pooled: None)
+
+    def publish(self, exchange: str, routing_key: str, body: str | bytes,
+                properties: pika.BasicProperties = PERSISTENT) -> None:
+        """Publish one message and wait for the broker's confirm. Raises if it is nacked or unroutable."""
+        self._run(lambda pooled: pooled.publish(exchange, routing_key, body, properties, mandatory=True))
+
+    def publish_batch(self, exchange: str, routing_key: str, bodies: Iterable[str | bytes],
+                      properties: pika.BasicProperties = PERSISTENT) -> None:
+        """Publish several messages on one pooled channel, each confirmed by the broker.
+
+        Raises if any is nacked; a retry may then publish some of them twice.
+        """
+        bodies = list(bodies)
+        if not bodies:
+            return
+
+        def action(pooled):
+            # BlockingChannel waits for each confirm in turn and has no public way to
+            # pipeline them; the win over connection-per-message is the pooled channel
+            for body in bodies:
+                pooled.publish(exchange, routing_key, body, properties)
+        self._run(action)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -2,74 +2,265 @@ import os
 import json
 import pika
 import time
+import uuid
 import threading
-from models import db, Reservation
+import redis
+from models import db, Reservation, OutboxMessage
 from flask import Flask
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from mq_publisher import Publisher
+from seat_state import free_reserved_seats, PENDING_STATUSES
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 MQ_QUEUE_REQUESTS = os.getenv("MQ_QUEUE_REQUESTS", "payment_requests")
 MQ_EXCHANGE_EVENTS = os.getenv("MQ_EXCHANGE_EVENTS", "payment_events")
+# ticket-service's queue: PAID orders this service accepted, sent through the outbox
+MQ_QUEUE_TICKETS = os.getenv("MQ_QUEUE_TICKETS", "q_tickets_generation")
+
+# Payment request lanes by time to showtime, served by payment_worker with weighted priority
+PAYMENT_LANE_URGENT = f"{MQ_QUEUE_REQUESTS}.urgent"
+PAYMENT_LANE_NORMAL = MQ_QUEUE_REQUESTS
+PAYMENT_LANE_LATER = f"{MQ_QUEUE_REQUESTS}.later"
+PAYMENT_URGENT_WITHIN = int(os.getenv("PAYMENT_URGENT_WITHIN", str(2 * 3600)))
+PAYMENT_LATER_AFTER = int(os.getenv("PAYMENT_LATER_AFTER", str(3 * 24 * 3600)))
+
+MQ_PUBLISH_POOL_SIZE = int(os.getenv("MQ_PUBLISH_POOL_SIZE", "4"))
+MQ_RESULT_BATCH_SIZE = int(os.getenv("MQ_RESULT_BATCH_SIZE", "100"))
+MQ_RESULT_BATCH_MS = int(os.getenv("MQ_RESULT_BATCH_MS", "50"))
+
+# Statuses payment_worker publishes
+PAYMENT_RESULT_STATUSES = ("PAID", "FAILED")
+# Database or Redis being unreachable: not the message's fault, so it must not be dropped
+INFRASTRUCTURE_ERRORS = (OperationalError, redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
 
 def get_connection():
     return pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
 
-def publish_payment_request(payload):
+def payment_lane(starts_at, now=None):
+    """Queue for a payment request whose screening starts at epoch `starts_at` (None: normal)."""
+    if starts_at is None:
+        return PAYMENT_LANE_NORMAL
+    until_show = starts_at - (time.time() if now is None else now)
+    if until_show <= PAYMENT_URGENT_WITHIN:
+        return PAYMENT_LANE_URGENT
+    if until_show > PAYMENT_LATER_AFTER:
+        return PAYMENT_LANE_LATER
+    return PAYMENT_LANE_NORMAL
+
+def _declare_publish_topology(channel):
+    for lane in (PAYMENT_LANE_URGENT, PAYMENT_LANE_NORMAL, PAYMENT_LANE_LATER):
+        channel.queue_declare(queue=lane, durable=True)
+    channel.queue_declare(queue=MQ_QUEUE_TICKETS, durable=True)
+
+publisher = Publisher(
+    lambda: pika.ConnectionParameters(host=RABBITMQ_HOST),
+    pool_size=MQ_PUBLISH_POOL_SIZE,
+    declare=_declare_publish_topology
+)
+
+def start_payment_publisher():
     try:
-        connection = get_connection()
-        channel = connection.channel()
-        channel.queue_declare(queue=MQ_QUEUE_REQUESTS, durable=True)
-
-        channel.basic_publish(
-            exchange='',
-            routing_key=MQ_QUEUE_REQUESTS,
-            body=json.dumps(payload),
-            properties=pika.BasicProperties(delivery_mode=2)
+        publisher.warm_up()
+        print(f" [MQ] Publisher ready ({MQ_PUBLISH_POOL_SIZE} channels max)")
+    except Exception as e:
+        # Not fatal: the pool connects on first use
+        print(f" [MQ] Publisher warm-up failed: {e}")
+
+def release_reservation_seats(res_ids):
+    # Clear the seat bits of these reservations; idempotent
+    rows = Reservation.query.with_entities(
+        Reservation.screening_id, Reservation.room_number, Reservation.seat_row, Reservation.seat_column
+    ).filter(Reservation.id.in_(res_ids)).all()
+    free_reserved_seats(rows)
+
+def _is_reservation_id(value):
+    # Reservation ids are str(uuid4()), String(36)
+    if not isinstance(value, str) or len(value) != 36:
+        return False
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+def _parse_payment_result(body):
+    """Decode one payment result message. None if it is not a result we can apply."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or data.get("status") not in PAYMENT_RESULT_STATUSES:
+        return None
+    res_ids = data.get("reservation_ids") or [data.get("reservation_id")]
+    if not isinstance(res_ids, list) or not all(_is_reservation_id(rid) for rid in res_ids):
+        return None
+    return data
+
+def _first_result_per_reservation(events):
+    # Results are applied pending -> final, so within a batch the first event for a
+    # reservation is the one that wins, exactly as if they were handled one by one
+    status_by_id = {}
+    for data in events:
+        res_ids = data.get("reservation_ids") or [data.get("reservation_id")]
+        for rid in res_ids:
+            if rid is not None and rid not in status_by_id:
+                status_by_id[rid] = data.get("status")
+    return status_by_id
+
+def _enqueue_ticket_requests(events, accepted):
+    # One ticket request per PAID order, limited to the seats whose reservation was accepted.
+    # Not outbox.enqueue_message: outbox imports this module for its publisher
+    for data in events:
+        if data.get("status") != "PAID":
+            continue
+        res_ids = data.get("reservation_ids") or [data["reservation_id"]]
+        offsets = data.get("seat_offsets")
+        if not isinstance(offsets, list) or len(offsets) != len(res_ids):
+            offsets = [None] * len(res_ids)
+        seats = [(rid, offset) for rid, offset in zip(res_ids, offsets) if rid in accepted]
+        if not seats:
+            continue
+        accepted.difference_update(rid for rid, _ in seats) # a duplicate event in the batch issues nothing
+        ticket = {
+            **data,
+            "reservation_id": seats[0][0],
+            "reservation_ids": [rid for rid, _ in seats],
+            "seat_offsets": [offset for _, offset in seats] if data.get("seat_offsets") else None,
+        }
+        db.session.add(OutboxMessage(routing_key=MQ_QUEUE_TICKETS, payload=json.dumps(ticket)))
+
+def apply_payment_results(events):
+    """Apply a batch of payment results: one UPDATE per status, one commit. Needs an app context."""
+    ids_by_status = {}
+    for rid, status in _first_result_per_reservation(events).items():
+        if status:
+            ids_by_status.setdefault(status, []).append(rid)
+
+    updated_by_status = {}
+    for status, res_ids in ids_by_status.items():
+        # Only pending rows move: a result arriving after the hold expired (or a
+        # redelivered one) must not resurrect the seat
+        stmt = (
+            update(Reservation)
+            .where(Reservation.id.in_(res_ids), Reservation.status.in_(PENDING_STATUSES))
+            .values(status=status)
+            .returning(Reservation.id)
         )
-        connection.close()
-        print(f" [MQ] Request sent for Reservation {payload.get('reservation_id')}")
+        updated_by_status[status] = db.session.execute(stmt).scalars().all()
+    # Same commit as the status change: a ticket is issued iff this service took the PAID,
+    # never for a late charge whose reservation had already expired and lost its seat
+    _enqueue_ticket_requests(events, set(updated_by_status.get("PAID", ())))
+    db.session.commit()
+
+    for status, res_ids in ids_by_status.items():
+        updated = updated_by_status[status]
+        print(f" [MQ] {len(updated)} reservations -> {status}")
+        if len(updated) < len(res_ids):
+            print(f" [DB] {len(res_ids) - len(updated)} of {len(res_ids)} reservations missing or no longer pending")
+
+    # Every FAILED id, not just the rows moved now: if Redis failed after an earlier commit,
+    # the redelivered batch updates nothing but must still free those seats. Seats a PAID or
+    # newer row owns are left alone (free_reserved_seats checks)
+    if ids_by_status.get("FAILED"):
+        release_reservation_seats(ids_by_status["FAILED"])
+
+def _apply_payment_result_batch(batch):
+    try:
+        apply_payment_results(batch)
+        return
+    except INFRASTRUCTURE_ERRORS:
+        db.session.rollback()
+        raise
     except Exception as e:
-        print(f" [MQ] Publish error: {e}")
+        db.session.rollback()
+        print(f" [MQ] Batch of {len(batch)} results failed ({e!r}), applying one by one")
+
+    # Isolate the message that broke the batch: the rest are applied, it is dropped,
+    # so one bad result can no longer hold up the whole queue with redeliveries
+    for data in batch:
+        try:
+            apply_payment_results([data])
+        except INFRASTRUCTURE_ERRORS:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            print(f" [MQ] Dropping payment result that cannot be applied ({e!r}): {data!r:.200}")
+
+def consume_payment_results(app: Flask, channel, queue_name, stop: threading.Event | None = None):
+    """Drain queue_name in batches of up to MQ_RESULT_BATCH_SIZE or MQ_RESULT_BATCH_MS, one multi-ack each.
+
+    When `stop` is set the batch in hand is applied and acked, and prefetched
+    messages not yet seen go back to the queue.
+    """
+    channel.basic_qos(prefetch_count=MQ_RESULT_BATCH_SIZE)
+
+    batch, last_tag, deadline = [], None, 0.0
+    poll = min(MQ_RESULT_BATCH_MS / 1000, 1.0)
+    for method, properties, body in channel.consume(queue_name, inactivity_timeout=poll):
+        if method is not None:
+            data = _parse_payment_result(body)
+            if data is None:
+                print(f" [MQ] Dropping malformed payment result: {body[:200]!r}")
+            else:
+                batch.append(data)
+            if last_tag is None:
+                deadline = time.monotonic() + MQ_RESULT_BATCH_MS / 1000
+            last_tag = method.delivery_tag
+
+        stopping = stop is not None and stop.is_set()
+        if last_tag is None:
+            if stopping:
+                break
+            continue
+        if len(batch) < MQ_RESULT_BATCH_SIZE and time.monotonic() < deadline and not stopping:
+            continue
+
+        if batch:
+            with app.app_context():
+                _apply_payment_result_batch(batch)
+        # Unacked messages are redelivered if we die before this, and re-applying is a no-op
+        channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        batch, last_tag = [], None
+        if stopping:
+            break
+
+    channel.cancel()
+
+def _declare_result_topology(channel):
+    channel.exchange_declare(exchange=MQ_EXCHANGE_EVENTS, exchange_type='fanout')
+    queue_name = 'q_movies_payment_updates'
+    channel.queue_declare(queue=queue_name, durable=True)
+    channel.queue_bind(exchange=MQ_EXCHANGE_EVENTS, queue=queue_name)
+    return queue_name
+
+def run_payment_result_consumer(app: Flask, stop: threading.Event | None = None):
+    """Consume payment results until `stop` is set, reconnecting on errors."""
+    stop = stop or threading.Event()
+    print(f" [MQ] Listener connecting to {RABBITMQ_HOST}...")
+    while not stop.is_set():
+        connection = None
+        try:
+            connection = get_connection()
+            channel = connection.channel()
+            queue_name = _declare_result_topology(channel)
+            consume_payment_results(app, channel, queue_name, stop)
+
+        except pika.exceptions.AMQPConnectionError:
+            print(" [MQ] Connection failed, retrying in 5s...")
+            stop.wait(5)
+        except Exception as e:
+            print(f" [MQ] Error: {e}, retrying in 5s...")
+            stop.wait(5)
+        finally:
+            # Closing hands any unacked results back to the queue
+            if connection is not None and connection.is_open:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
 
 def start_payment_result_listener(app: Flask):
-    def listener():
-        print(f" [MQ] Listener connecting to {RABBITMQ_HOST}...")
-        while True:
-            try:
-                connection = get_connection()
-                channel = connection.channel()
-
-                channel.exchange_declare(exchange=MQ_EXCHANGE_EVENTS, exchange_type='fanout')
-                queue_name = 'q_movies_payment_updates'
-                channel.queue_declare(queue=queue_name, durable=True)
-                channel.queue_bind(exchange=MQ_EXCHANGE_EVENTS, queue=queue_name)
-
-                def callback(ch, method, properties, body):
-                    data = json.loads(body)
-                    res_id = data.get("reservation_id")
-                    status = data.get("status")
-
-                    print(f" [MQ] Update received: {res_id} -> {status}")
-
-                    with app.app_context():
-                        reservation = db.session.get(Reservation, res_id)
-                        if reservation:
-                            reservation.status = status
-                            db.session.commit()
-                        else:
-                            print(f" [DB] Reservation {res_id} missing")
-
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-
-                channel.basic_qos(prefetch_count=1)
-                channel.basic_consume(queue=queue_name, on_message_callback=callback)
-                channel.start_consuming()
-
-            except pika.exceptions.AMQPConnectionError:
-                print(" [MQ] Connection failed, retrying in 5s...")
-                time.sleep(5)
-            except Exception as e:
-                print(f" [MQ] Error: {e}, retrying in 5s...")
-                time.sleep(5)
-
-    thread = threading.Thread(target=listener, daemon=True)
+    thread = threading.Thread(target=run_payment_result_consumer, args=(app,), daemon=True)
     thread.start()
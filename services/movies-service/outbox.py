@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+import metrics
+from models import db, OutboxMessage
+from mq_utils import publisher
+
+OUTBOX_RELAY_INTERVAL = float(os.getenv("OUTBOX_RELAY_INTERVAL", "0.5"))
+OUTBOX_RELAY_BATCH = int(os.getenv("OUTBOX_RELAY_BATCH", "200"))
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+OUTBOX_PURGE_INTERVAL = int(os.getenv("OUTBOX_PURGE_INTERVAL", "300"))
+
+# Set after a commit that wrote outbox rows, so this replica's relay does not wait for its next poll
+_wakeup = threading.Event()
+
+def enqueue_message(routing_key, payload):
+    """Add a message to the current transaction; it is published once the transaction commits."""
+    db.session.add(OutboxMessage(routing_key=routing_key, payload=json.dumps(payload)))
+
+def notify_relay():
+    _wakeup.set()
+
+def relay_outbox_once(batch_size=OUTBOX_RELAY_BATCH):
+    """Publish unsent outbox rows in batches and mark them sent. Returns the count."""
+    sent = 0
+    while True:
+        # SKIP LOCKED lets every replica relay side by side without sending a row twice
+        rows = db.session.execute(
+            select(OutboxMessage.id, OutboxMessage.routing_key, OutboxMessage.payload)
+            .where(OutboxMessage.sent_at.is_(None))
+            .order_by(OutboxMessage.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            db.session.commit()
+            return sent
+
+        try:
+            by_key = {}
+            for row in rows:
+                by_key.setdefault(row.routing_key, []).append(row.payload)
+            for routing_key, payloads in by_key.items():
+                publisher.publish_batch('', routing_key, payloads)
+
+            db.session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id.in_([row.id for row in rows]))
+                .values(sent_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception:
+            # Rows stay unsent and go out on the next pass; consumers tolerate the rare duplicate
+            db.session.rollback()
+            raise
+
+        sent += len(rows)
+        if len(rows) < batch_size:
+            return sent
+
+def record_outbox_lag():
+    pending, oldest = db.session.execute(
+        select(func.count(OutboxMessage.id), func.min(OutboxMessage.created_at))
+        .where(OutboxMessage.sent_at.is_(None))
+    ).one()
+    db.session.commit()
+
+    lag = (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    metrics.set_value("outbox_pending", pending)
+    metrics.set_value("outbox_lag_seconds", round(lag, 3))
+    return lag
+
+def purge_sent_outbox(now=None):
+    now = datetime.utcnow() if now is None else now
+    deleted = db.session.execute(
+        delete(OutboxMessage).where(OutboxMessage.sent_at < now - timedelta(hours=OUTBOX_RETENTION_HOURS))
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+def start_outbox_relay(app):
+    def loop():
+        next_purge = 0.0
+        while True:
+            _wakeup.wait(OUTBOX_RELAY_INTERVAL)
+            _wakeup.clear()
+            with app.app_context():
+                try:
+                    sent = relay_outbox_once()
+                    metrics.incr("outbox_sent_total", sent)
+                    record_outbox_lag()
+
+                    now = datetime.utcnow().timestamp()
+                    if now >= next_purge:
+                        next_purge = now + OUTBOX_PURGE_INTERVAL
+                        purged = purge_sent_outbox()
+                        if purged:
+                            print(f" [Outbox] Purged {purged} sent messages")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f" [Outbox] Relay error: {e}, retrying in 5s...")
+                    time.sleep(5)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
@@ -0,0 +1,62 @@
+import os
+import signal
+import threading
+from flask import Flask
+from dotenv import load_dotenv
+from models import db
+from mq_utils import run_payment_result_consumer
+from utils import DATABASE_URL
+
+# Standalone payment-result consumer: runs the same batching consumer as the
+# in-process listener, but in its own process so it scales apart from the API.
+#   python payment_consumer.py
+
+load_dotenv()
+
+PAYMENT_CONSUMER_CONCURRENCY = int(os.getenv("PAYMENT_CONSUMER_CONCURRENCY", "4"))
+PAYMENT_CONSUMER_DRAIN_SECONDS = float(os.getenv("PAYMENT_CONSUMER_DRAIN_SECONDS", "20"))
+
+app = Flask(__name__)
+
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# One connection per consumer thread, never more
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    "pool_pre_ping": True,
+    "pool_size": PAYMENT_CONSUMER_CONCURRENCY,
+    "max_overflow": 0,
+}
+
+db.init_app(app)
+
+def main():
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        print(f" [Consumer] Signal {signum}, draining in-flight batches...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Each thread has its own connection and channel, competing on the same queue
+    threads = [
+        threading.Thread(target=run_payment_result_consumer, args=(app, stop), name=f"consumer-{i}", daemon=True)
+        for i in range(PAYMENT_CONSUMER_CONCURRENCY)
+    ]
+    for t in threads:
+        t.start()
+    print(f" [Consumer] Started {len(threads)} payment result consumers")
+
+    while not stop.is_set():
+        stop.wait(1)
+
+    for t in threads:
+        t.join(PAYMENT_CONSUMER_DRAIN_SECONDS)
+    alive = [t.name for t in threads if t.is_alive()]
+    if alive:
+        print(f" [Consumer] Gave up waiting for {alive}, their unacked messages will be redelivered")
+    print(" [Consumer] Stopped")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,56 @@
 import os
 import json
+import time
 import redis
+from datetime import datetime
 from utils import REDIS_HOST, REDIS_PORT
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+r_raw = redis.Redis(host=REDIS_HOST, port=REDIS_PORT) # binary values (seat bitmaps)
 
 PREFIX_ROOM = "room"
 PREFIX_MOVIE = "movie"
 PREFIX_SCREENING = "screening"
 SET_ROOMS = "rooms" # Set of room IDs
 SET_MOVIES = "movies" # Set of movie IDs
-SET_SCREENINGS_BY_MOVIE = "movie_screenings" # key: movie_screenings:{movie_id} -> Set of screening IDs
+SET_SCREENINGS_BY_MOVIE = "movie_screenings" # legacy per-movie Set, replaced by ZSET_SCREENINGS_BY_MOVIE
+ZSET_SCREENINGS_BY_MOVIE = "movie_schedule" # key: movie_schedule:{movie_id} -> ZSet screening ID scored by start epoch
+ZSET_SCREENINGS = "schedule" # ZSet of all screening IDs scored by start epoch
+SET_SCREENINGS_BY_ROOM = "room_screenings" # key: room_screenings:{room_number} -> Set of screening IDs
+HASH_SCREENING_ROOM = "screening_room" # Hash screening ID -> room number
+PREFIX_SEATS = "seats" # key: seats:{screening_id} -> bitmap, bit row*cols+col set = seat taken
+PREFIX_SEATS_REBUILD = "seats_rebuild" # key: seats_rebuild:{screening_id} -> token of the replica rebuilding it
+PREFIX_SEATS_JOURNAL = "seats_journal" # key: seats_journal:{screening_id} -> List "offset:bit" set during the rebuild
+ZSET_SEAT_HOLDS = "seat_holds" # ZSet "{screening_id}:{offset}:{hold_id}" scored by hold deadline
+PREFIX_ADMITTED = "admitted" # key: admitted:{screening_id} -> bitmap, bit set = ticket for that seat scanned in
+
+# Admitted bitmaps outlive the screening's own keys: late arrivals are still scanned after it starts
+ADMITTED_TTL = int(os.getenv("ADMITTED_TTL", str(3 * 24 * 3600)))
+
+# Max keys per MGET, so one huge set doesn't block Redis or build a giant reply
+MGET_CHUNK_SIZE = int(os.getenv("REDIS_MGET_CHUNK_SIZE", "500"))
+
+# --- Bulk reads ---
+def get_many(prefix, ids):
+    """Fetch and decode `prefix:{id}` for every id, in chunked MGETs sent in one pipeline."""
+    ids = list(ids)
+    if not ids:
+        return []
+
+    pipe = r.pipeline(transaction=False)
+    for start in range(0, len(ids), MGET_CHUNK_SIZE):
+        chunk = ids[start:start + MGET_CHUNK_SIZE]
+        pipe.mget([f"{prefix}:{i}" for i in chunk])
+
+    items = []
+    for values in pipe.execute():
+        for data in values:
+            if data:
+                items.append(json.loads(data))
+    return items
+
+def get_all_members(set_key, prefix):
+    return get_many(prefix, r.smembers(set_key))
 
 # --- Rooms ---
 def add_room(number, rows, cols):
@@ -27,26 +67,18 @@ def get_room(number):
     return json.loads(data) if data else None
 
 def delete_room(number):
-    mids = r.smembers(SET_MOVIES)
-    for mid in mids:
-        sids = r.smembers(f"{SET_SCREENINGS_BY_MOVIE}:{mid}")
-        for sid in sids:
-            sc = get_screening(sid)
-            if sc and sc.get("room_number") == number:
-                delete_screening(sid)
+    screenings = get_all_members(f"{SET_SCREENINGS_BY_ROOM}:{number}", PREFIX_SCREENING)
 
-    key = f"{PREFIX_ROOM}:{number}"
-    r.delete(key)
-    r.srem(SET_ROOMS, number)
+    pipe = r.pipeline(transaction=True)
+    for sc in screenings:
+        _queue_screening_delete(pipe, sc)
+    pipe.delete(f"{SET_SCREENINGS_BY_ROOM}:{number}")
+    pipe.delete(f"{PREFIX_ROOM}:{number}")
+    pipe.srem(SET_ROOMS, number)
+    pipe.execute()
 
 def get_all_rooms():
-    numbers = r.smembers(SET_ROOMS)
-    rooms = []
-    for num in numbers:
-        room = get_room(num)
-        if room:
-            rooms.append(room)
-    return rooms
+    return get_all_members(SET_ROOMS, PREFIX_ROOM)
 
 # --- Movies ---
 def add_movie(movie_curr):
@@ -62,14 +94,12 @@ def get_movie(mid):
     data = r.get(key)
     return json.loads(data) if data else None
 
+def get_movies(mids):
+    # dict mid -> movie for a batch of ids (missing ones are left out)
+    return {mv["id"]: mv for mv in get_many(PREFIX_MOVIE, set(mids))}
+
 def get_all_movies():
-    mids = r.smembers(SET_MOVIES)
-    movies = []
-    for mid in mids:
-        mv = get_movie(mid)
-        if mv:
-            movies.append(mv)
-    return movies
+    return get_all_members(SET_MOVIES, PREFIX_MOVIE)
 
 def update_movie(mid, data):
     current = get_movie(mid)
@@ -80,22 +110,37 @@ def update_movie(mid, data):
     return current
 
 def delete_movie(mid):
-    screenings = get_screenings_for_movie(mid)
-    for sc in screenings:
-        delete_screening(sc["id"])
+    screenings = get_screenings_for_movie(mid, upcoming_only=False)
 
-    key = f"{PREFIX_MOVIE}:{mid}"
-    r.delete(key)
-    r.srem(SET_MOVIES, mid)
+    pipe = r.pipeline(transaction=True)
+    for sc in screenings:
+        _queue_screening_delete(pipe, sc)
+    pipe.delete(f"{ZSET_SCREENINGS_BY_MOVIE}:{mid}")
+    pipe.delete(f"{PREFIX_MOVIE}:{mid}")
+    pipe.srem(SET_MOVIES, mid)
+    pipe.execute()
 
 # --- Screenings ---
+def screening_start(screening_data):
+    # Start time as a local epoch; raises ValueError on a malformed date/time
+    dt = datetime.strptime(f"{screening_data['date']} {screening_data['time']}", "%Y-%m-%d %H:%M")
+    return dt.timestamp()
+
 def add_screening(screening_data):
     sid = screening_data["id"]
     mid = screening_data["movie_id"]
     key = f"{PREFIX_SCREENING}:{sid}"
 
-    r.set(key, json.dumps(screening_data))
-    r.sadd(f"{SET_SCREENINGS_BY_MOVIE}:{mid}", sid)
+    room = screening_data["room_number"]
+    starts_at = screening_start(screening_data)
+
+    pipe = r.pipeline(transaction=True)
+    pipe.set(key, json.dumps(screening_data))
+    pipe.zadd(f"{ZSET_SCREENINGS_BY_MOVIE}:{mid}", {sid: starts_at})
+    pipe.zadd(ZSET_SCREENINGS, {sid: starts_at})
+    pipe.sadd(f"{SET_SCREENINGS_BY_ROOM}:{room}", sid)
+    pipe.hset(HASH_SCREENING_ROOM, sid, room)
+    pipe.execute()
     return screening_data
 
 def get_screening(sid):
@@ -103,13 +148,17 @@ def get_screening(sid):
     data = r.get(key)
     return json.loads(data) if data else None
 
-def get_screenings_for_movie(mid):
-    sids = r.smembers(f"{SET_SCREENINGS_BY_MOVIE}:{mid}")
-    screenings = []
-    for sid in sids:
-        sc = get_screening(sid)
-        if sc:
-            screenings.append(sc)
+def get_screenings_for_movie(mid, upcoming_only=True):
+    # Already ordered by start time; past ones are skipped unless asked for
+    low = time.time() if upcoming_only else "-inf"
+    sids = r.zrangebyscore(f"{ZSET_SCREENINGS_BY_MOVIE}:{mid}", low, "+inf")
+    return get_many(PREFIX_SCREENING, sids)
+
+def get_screening_start(sid):
+    return r.zscore(ZSET_SCREENINGS, sid)
+
+def get_screenings_for_room(number):
+    screenings = get_all_members(f"{SET_SCREENINGS_BY_ROOM}:{number}", PREFIX_SCREENING)
 
     try:
         screenings.sort(key=lambda x: (x["date"], x["time"]))
@@ -117,11 +166,229 @@ def get_screenings_for_movie(mid):
         pass
     return screenings
 
+def get_screening_room(sid):
+    return r.hget(HASH_SCREENING_ROOM, sid)
+
+def _queue_screening_delete(pipe, sc):
+    sid = sc["id"]
+    pipe.zrem(f"{ZSET_SCREENINGS_BY_MOVIE}:{sc['movie_id']}", sid)
+    pipe.zrem(ZSET_SCREENINGS, sid)
+    pipe.srem(f"{SET_SCREENINGS_BY_ROOM}:{sc['room_number']}", sid)
+    pipe.hdel(HASH_SCREENING_ROOM, sid)
+    pipe.delete(f"{PREFIX_SCREENING}:{sid}")
+    pipe.delete(f"{PREFIX_SEATS}:{sid}")
+
 def delete_screening(sid):
     sc = get_screening(sid)
     if sc:
-        mid = sc["movie_id"]
-        r.srem(f"{SET_SCREENINGS_BY_MOVIE}:{mid}", sid)
-        r.delete(f"{PREFIX_SCREENING}:{sid}")
+        pipe = r.pipeline(transaction=True)
+        _queue_screening_delete(pipe, sc)
+        pipe.execute()
         return True
+
+    # Payload already gone: still drop it from the indexes
+    room = get_screening_room(sid)
+    pipe = r.pipeline(transaction=True)
+    if room:
+        pipe.srem(f"{SET_SCREENINGS_BY_ROOM}:{room}", sid)
+        pipe.hdel(HASH_SCREENING_ROOM, sid)
+    pipe.zrem(ZSET_SCREENINGS, sid)
+    pipe.execute()
     return False
+
+def evict_past_screenings(now=None, batch_size=500):
+    """Delete every screening that started before `now`, batch_size at a time. Returns the count."""
+    now = time.time() if now is None else now
+    evicted = 0
+    while True:
+        sids = r.zrangebyscore(ZSET_SCREENINGS, "-inf", f"({now}", start=0, num=batch_size)
+        if not sids:
+            return evicted
+
+        screenings = get_many(PREFIX_SCREENING, sids)
+        pipe = r.pipeline(transaction=True)
+        for sc in screenings:
+            _queue_screening_delete(pipe, sc)
+        # ids whose payload vanished would otherwise be returned forever
+        pipe.zrem(ZSET_SCREENINGS, *sids)
+        pipe.execute()
+        evicted += len(screenings)
+
+def rebuild_screening_indexes():
+    """Backfill the room and schedule indexes for screenings cached before they existed."""
+    sids = [key.split(":", 1)[1] for key in r.scan_iter(match=f"{PREFIX_SCREENING}:*", count=1000)]
+    screenings = get_many(PREFIX_SCREENING, sids)
+
+    pipe = r.pipeline(transaction=False)
+    for sc in screenings:
+        pipe.sadd(f"{SET_SCREENINGS_BY_ROOM}:{sc['room_number']}", sc["id"])
+        pipe.hset(HASH_SCREENING_ROOM, sc["id"], sc["room_number"])
+        try:
+            starts_at = screening_start(sc)
+        except (KeyError, ValueError):
+            print(f"Screening {sc['id']} has no valid date/time, left out of the schedule")
+            continue
+        pipe.zadd(f"{ZSET_SCREENINGS_BY_MOVIE}:{sc['movie_id']}", {sc["id"]: starts_at})
+        pipe.zadd(ZSET_SCREENINGS, {sc["id"]: starts_at})
+    for key in r.scan_iter(match=f"{SET_SCREENINGS_BY_MOVIE}:*", count=1000):
+        pipe.delete(key)
+    pipe.execute()
+    return len(screenings)
+
+# --- Seat bitmaps ---
+# Only touch bitmaps that already exist: SETBIT on a missing key would create a
+# partial bitmap that hides every seat it was never told about.
+# While a replica rebuilds a missing bitmap from Postgres (seats_rebuild:{sid} held),
+# changes are journaled instead and replayed onto the snapshot when it is published,
+# so a seat taken or freed between the Postgres read and the store is not lost.
+SEAT_REBUILD_TTL = int(os.getenv("SEAT_REBUILD_TTL", "30"))
+
+_set_seats_if_present = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        for i = 2, #ARGV do
+            redis.call('RPUSH', KEYS[3], ARGV[i] .. ':' .. ARGV[1])
+        end
+        redis.call('EXPIRE', KEYS[3], %d)
+    end
+    return 0
+end
+for i = 2, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], ARGV[1])
+end
+return 1
+""" % SEAT_REBUILD_TTL)
+
+# Store a rebuilt bitmap and replay the journal onto it, only while we still hold the lock
+_publish_seat_bitmap = r_raw.register_script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+for _, entry in ipairs(redis.call('LRANGE', KEYS[3], 0, -1)) do
+    local sep = string.find(entry, ':', 1, true)
+    redis.call('SETBIT', KEYS[1], tonumber(string.sub(entry, 1, sep - 1)), tonumber(string.sub(entry, sep + 1)))
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+return 1
+""")
+
+_release_seat_rebuild = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+""")
+
+def _seat_keys(sid):
+    return [f"{PREFIX_SEATS}:{sid}", f"{PREFIX_SEATS_REBUILD}:{sid}", f"{PREFIX_SEATS_JOURNAL}:{sid}"]
+
+def seat_offset(row, col, cols):
+    return row * cols + col
+
+def mark_seats(sid, offsets, taken=True):
+    """Set (or clear) seat bits on a loaded bitmap. Returns False if the bitmap isn't loaded."""
+    if not offsets:
+        return True
+    return bool(_set_seats_if_present(keys=_seat_keys(sid), args=[1 if taken else 0, *offsets]))
+
+def get_seat_bitmap(sid):
+    return r_raw.get(f"{PREFIX_SEATS}:{sid}")
+
+def acquire_seat_rebuild(sid, token):
+    return bool(r.set(f"{PREFIX_SEATS_REBUILD}:{sid}", token, nx=True, ex=SEAT_REBUILD_TTL))
+
+def release_seat_rebuild(sid, token):
+    _release_seat_rebuild(keys=_seat_keys(sid)[1:], args=[token])
+
+def delete_seat_bitmap(sid):
+    r.delete(f"{PREFIX_SEATS}:{sid}")
+
+def publish_seat_bitmap(sid, bitmap, token):
+    """Store a rebuilt bitmap plus the changes journaled since the rebuild started, and release
+    the lock. Returns False (nothing stored) if the lock expired in the meantime."""
+    return bool(_publish_seat_bitmap(keys=_seat_keys(sid), args=[bytes(bitmap), token]))
+
+# Claim all seats or none. Returns -1 if the bitmap isn't loaded, 0 if a seat is taken, 1 on success.
+_claim_seats = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+for i = 4, #ARGV do
+    if redis.call('GETBIT', KEYS[1], ARGV[i]) == 1 then
+        return 0
+    end
+end
+for i = 4, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2] .. ARGV[i] .. ':' .. ARGV[3])
+end
+return 1
+""")
+
+# Drop holds; with ARGV[1] == 1 also free the seat, but only for holds we still own.
+# A missing bitmap is left missing (journaled if it is being rebuilt)
+_release_seats = r.register_script("""
+local present = redis.call('EXISTS', KEYS[1]) == 1
+local rebuilding = redis.call('EXISTS', KEYS[3]) == 1
+local freed = 0
+for i = 2, #ARGV, 2 do
+    if redis.call('ZREM', KEYS[2], ARGV[i]) == 1 and ARGV[1] == '1' then
+        if present then
+            redis.call('SETBIT', KEYS[1], ARGV[i + 1], 0)
+        elseif rebuilding then
+            redis.call('RPUSH', KEYS[4], ARGV[i + 1] .. ':0')
+            redis.call('EXPIRE', KEYS[4], %d)
+        end
+        freed = freed + 1
+    end
+end
+return freed
+""" % SEAT_REBUILD_TTL)
+
+def hold_member(sid, offset, hold_id):
+    return f"{sid}:{offset}:{hold_id}"
+
+def claim_seat_bits(sid, offsets, hold_id, deadline):
+    return _claim_seats(keys=[f"{PREFIX_SEATS}:{sid}", ZSET_SEAT_HOLDS],
+                        args=[deadline, f"{sid}:", hold_id, *offsets])
+
+def release_seat_bits(sid, offsets, hold_id, free_seats=True):
+    args = [1 if free_seats else 0]
+    for offset in offsets:
+        args += [hold_member(sid, offset, hold_id), offset]
+    bitmap_key, rebuild_key, journal_key = _seat_keys(sid)
+    return _release_seats(keys=[bitmap_key, ZSET_SEAT_HOLDS, rebuild_key, journal_key], args=args)
+
+def get_live_seat_hold_offsets(sid, now=None):
+    # Seats held for a booking whose row is not committed yet
+    now = time.time() if now is None else now
+    return {
+        int(member.split(":")[1])
+        for member, deadline in r.zscan_iter(ZSET_SEAT_HOLDS, match=f"{sid}:*", count=1000)
+        if deadline >= now
+    }
+
+def get_expired_seat_holds(now=None, limit=500):
+    # -> list of (screening_id, offset, hold_id)
+    now = time.time() if now is None else now
+    members = r.zrangebyscore(ZSET_SEAT_HOLDS, "-inf", f"({now}", start=0, num=limit)
+    holds = []
+    for member in members:
+        sid, offset, hold_id = member.split(":")
+        holds.append((sid, int(offset), hold_id))
+    return holds
+
+# --- Entry scans ---
+def admit_seats(scans):
+    """Mark every (screening_id, offset) admitted, in order, in one round trip.
+
+    Returns the previous bit per scan: 0 = admitted now, 1 = was already admitted.
+    """
+    if not scans:
+        return []
+    pipe = r.pipeline(transaction=False)
+    for sid, offset in scans:
+        pipe.setbit(f"{PREFIX_ADMITTED}:{sid}", offset, 1)
+    for sid in {sid for sid, _ in scans}:
+        pipe.expire(f"{PREFIX_ADMITTED}:{sid}", ADMITTED_TTL)
+    return pipe.execute()[:len(scans)]
@@ -1,18 +1,38 @@
 from flask import Blueprint, request, jsonify
-from utils import decode_and_verify_access_token, extract_roles
+from utils import decode_and_verify_access_token, extract_roles, TICKET_SIGNING_KEYS
 import uuid
 from models import db, Movie, Room, Screening
 from redis_client import (
     add_room as redis_add_room, get_room, get_all_rooms, add_movie as redis_add_movie,
-    get_movie, get_all_movies, update_movie as redis_update_movie, delete_movie as redis_delete_movie,
-    add_screening as redis_add_screening, get_screening, get_screenings_for_movie, delete_screening as redis_delete_screening
+    get_movie, get_movies, get_all_movies, update_movie as redis_update_movie, delete_movie as redis_delete_movie,
+    add_screening as redis_add_screening, get_screening, get_screenings_for_movie, get_screenings_for_room,
+    get_screening_start, screening_start, delete_screening as redis_delete_screening,
+    seat_offset, admit_seats
 )
 from models import db, Movie, Room, Screening, Reservation
-from mq_utils import publish_payment_request
-from datetime import datetime
+from mq_utils import payment_lane
+from outbox import enqueue_message, notify_relay
+from ticket_codes import verify_ticket_code
+from seat_state import (
+    load_seat_bitmap, rebuild_seat_bitmap, bitmap_to_matrix, bitmap_to_b64,
+    claim_seats, confirm_seat_hold, release_seat_hold, release_conflicting_seat_hold
+)
+from datetime import datetime, timedelta
+import os
+import time
+import base64
+from sqlalchemy import tuple_
 
 api = Blueprint('api', __name__)
 
+MAX_SEATS_PER_ORDER = int(os.getenv("MAX_SEATS_PER_ORDER", "10"))
+# How long a pending reservation blocks its seats while payment is in flight
+RESERVATION_HOLD_SECONDS = int(os.getenv("RESERVATION_HOLD_SECONDS", "900"))
+RESERVATIONS_PAGE_SIZE = int(os.getenv("RESERVATIONS_PAGE_SIZE", "20"))
+RESERVATIONS_MAX_PAGE_SIZE = 100
+# Scans a handheld scanner may upload at once after being offline
+SCAN_BATCH_MAX = int(os.getenv("SCAN_BATCH_MAX", "1000"))
+
 # --- Auth Helper ---
 def check_role(required_roles):
     auth_header = request.headers.get("Authorization")
@@ -43,15 +63,6 @@ def check_role(required_roles):
         return None, ({"ok": False, "error": f"Invalid token: {str(exc)}"}, 401)
 
 
-def is_screening_expired(sc):
-    try:
-        dt_str = f"{sc.get('date')} {sc.get('time')}"
-        dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
-        return dt < datetime.now()
-    except Exception:
-        return False
-
-
 # --- MOVIES Endpoints ---
 
 @api.get("/movies")
@@ -165,6 +176,13 @@ def create_room():
     redis_add_room(data["number"], int(data["rows"]), int(data["cols"]))
     return jsonify({"ok": True, "message": "Room created"}), 201
 
+@api.get("/rooms/<number>/screenings")
+def list_room_screenings(number):
+    if not get_room(number):
+        return jsonify({"ok": False, "error": "Room not found"}), 404
+
+    return jsonify({"ok": True, "data": get_screenings_for_room(number)})
+
 
 # --- SCREENINGS (Program) Endpoints ---
 
@@ -173,17 +191,8 @@ def list_screenings(mid):
     if not get_movie(mid):
         return jsonify({"ok": False, "error": "Movie not found"}), 404
 
-    all_screenings = get_screenings_for_movie(mid)
-    valid_screenings = []
-
-    for sc in all_screenings:
-        if is_screening_expired(sc):
-            print(f"Expired screening {sc['id']} detected. Removing from Redis.")
-            redis_delete_screening(sc['id'])
-        else:
-            valid_screenings.append(sc)
-
-    return jsonify({"ok": True, "data": valid_screenings})
+    # Upcoming only; past screenings are evicted by the janitor, not here
+    return jsonify({"ok": True, "data": get_screenings_for_movie(mid)})
 
 @api.post("/movies/<mid>/screenings")
 def add_new_screening(mid):
@@ -202,6 +211,11 @@ def add_new_screening(mid):
     if not get_room(room_num):
          return jsonify({"ok": False, "error": f"Room {room_num} does not exist"}), 400
 
+    try:
+        screening_start(data)
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid date (YYYY-MM-DD) or time (HH:MM)"}), 400
+
     new_screening = Screening(
         movie_id=mid,
         room_number=room_num,
@@ -254,42 +268,44 @@ def view_seats(mid, sid):
     rows = room["rows"]
     cols = room["cols"]
 
-    # Construct Matrix
-    # 0 = Free, 1 = Taken (Reserved/Paid)
-
-    matrix = []
-
-    # Pre-fetch reservations for this screening
-    taken_seats = set()
     try:
-        reservations = Reservation.query.filter(
-            Reservation.screening_id == sid,
-            Reservation.status.in_(['paid', 'pending', 'PAID', 'PENDING'])
-        ).all()
-        for res in reservations:
-            taken_seats.add((res.seat_row, res.seat_column))
+        bitmap = load_seat_bitmap(sid, room)
     except Exception as e:
-        print(f"Error fetching reservations: {e}")
-
-    for r in range(rows):
-        row_arr = []
-        for c in range(cols):
-            if (r, c) in taken_seats:
-                row_arr.append(1)
-            else:
-                row_arr.append(0)
-        matrix.append(row_arr)
-
-    return jsonify({
-        "ok": True,
-        "data": {
-            "room": room_num,
-            "layout": matrix,
-            "rows": rows,
-            "cols": cols,
-            "screening": screening
-        }
-    })
+        print(f"Error loading seat map: {e}")
+        return jsonify({"ok": False, "error": "System busy"}), 500
+
+    data = {
+        "room": room_num,
+        "rows": rows,
+        "cols": cols,
+        "screening": screening
+    }
+
+    # ?format=bitset: base64 bitmap instead of the nested list (kept as default for old clients)
+    if request.args.get("format") == "bitset":
+        data["encoding"] = "bitset"
+        data["seats"] = bitmap_to_b64(bitmap, rows, cols)
+    else:
+        data["layout"] = bitmap_to_matrix(bitmap, rows, cols)
+
+    return jsonify({"ok": True, "data": data})
+
+
+@api.post("/movies/<mid>/screenings/<sid>/seats/reconcile")
+def reconcile_seats(mid, sid):
+    user, err = check_role(["admin", "editor"])
+    if err: return err
+
+    screening = get_screening(sid)
+    if not screening:
+        return jsonify({"ok": False, "error": "Screening not found"}), 404
+
+    room = get_room(screening["room_number"])
+    if not room:
+         return jsonify({"ok": False, "error": "Room definition missing"}), 500
+
+    rebuild_seat_bitmap(sid, room)
+    return jsonify({"ok": True, "message": "Seat map rebuilt from database"})
 
 
 # --- FEED (Compatibility) ---
@@ -302,6 +318,101 @@ def feed_compat_redirect():
 
 # --- RESERVATIONS ---
 
+def _reserve_seats(user_id, screening_id, seats):
+    """Reserve seats [(row, col)] of one screening for a user, all or nothing.
+
+    Claims every seat in Redis, then inserts all rows and a single payment request
+    for the combined amount (via the outbox) in one transaction. Returns (body, status).
+    """
+    screening = get_screening(screening_id)
+    if not screening:
+        return {"ok": False, "error": "Screening not found"}, 404
+
+    starts_at = get_screening_start(screening_id)
+    if starts_at is not None and starts_at < time.time():
+        return {"ok": False, "error": "Screening has expired"}, 400
+
+    room = get_room(screening["room_number"])
+    if not room:
+        return {"ok": False, "error": "Room definition missing"}, 500
+
+    for seat_row, seat_col in seats:
+        if not (0 <= seat_row < room["rows"] and 0 <= seat_col < room["cols"]):
+            return {"ok": False, "error": "Seat outside room"}, 400
+
+    # Losers are rejected here, in Redis, without touching Postgres
+    try:
+        hold = claim_seats(screening_id, room, seats)
+    except Exception as e:
+        return {"ok": False, "error": "System busy"}, 500
+
+    if not hold:
+        return {"ok": False, "error": "Seat already reserved"}, 409
+
+    try:
+        dt_obj = datetime.fromtimestamp(starts_at) if starts_at is not None else datetime.now()
+        hold_until = time.time() + RESERVATION_HOLD_SECONDS
+        expires_at = datetime.utcfromtimestamp(hold_until)
+
+        new_reservations = [
+            Reservation(
+                user_id=user_id,
+                movie_id=screening.get("movie_id", "unknown"),
+                room_number=screening.get("room_number", "unknown"),
+                screening_id=screening_id,
+                seat_row=seat_row,
+                seat_column=seat_col,
+                screening_datetime=dt_obj,
+                status="pending",
+                expires_at=expires_at
+            )
+            for seat_row, seat_col in seats
+        ]
+        db.session.add_all(new_reservations)
+        db.session.flush()
+        reservation_ids = [res.id for res in new_reservations]
+
+        # Payload for RabbitMQ (payment_worker), one charge for the whole order.
+        # Screening and seat offsets travel on to ticket-service for the signed QR codes
+        price = float(screening.get("price", 15.0))
+        amount_cents = int(price * 100) * len(seats)
+
+        # Same commit as the rows: the request goes out iff the reservation exists.
+        # Shows starting soon go to the urgent lane so they are charged first
+        enqueue_message(payment_lane(starts_at), {
+            "reservation_id": reservation_ids[0],
+            "reservation_ids": reservation_ids,
+            "user_id": user_id,
+            "amount": amount_cents,
+            "currency": "usd",
+            "screening_datetime": dt_obj.isoformat(),
+            "screening_id": screening_id,
+            "seat_offsets": [seat_offset(seat_row, seat_col, room["cols"]) for seat_row, seat_col in seats],
+            # Epoch seconds; the janitor expires the rows after this, so the worker must not charge later
+            "expires_at": hold_until
+        })
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if "ix_unique_seat_reservation" in str(e) or "UniqueViolation" in str(e):
+            # Bitmap was stale for the seat a committed row owns: fix just that bit.
+            # No rebuild, which would wipe the bits of other bookings' in-flight holds
+            release_conflicting_seat_hold(hold, room)
+            return {"ok": False, "error": "Seat already reserved"}, 409
+
+        release_seat_hold(hold)
+        return {"ok": False, "error": "Could not create reservation record"}, 500
+
+    confirm_seat_hold(hold)
+    notify_relay()
+
+    return {
+        "ok": True,
+        "message": "Reservation initiated",
+        "reservation_id": reservation_ids[0],
+        "reservation_ids": reservation_ids
+    }, 200
+
 @api.post("/reservations")
 def create_reservation():
     user_payload, err = check_role(["admin", "editor", "viewer"])
@@ -322,83 +433,54 @@ def create_reservation():
     if not screening_id or seat_row is None or seat_col is None:
         return jsonify({"ok": False, "error": "Missing reservation fields"}), 400
 
-    screening = get_screening(screening_id)
-    if not screening:
-        return jsonify({"ok": False, "error": "Screening not found"}), 404
-
-    if is_screening_expired(screening):
-        redis_delete_screening(screening_id)
-        return jsonify({"ok": False, "error": "Screening has expired"}), 400
+    try:
+        seat_row, seat_col = int(seat_row), int(seat_col)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Invalid seat"}), 400
 
+    body, code = _reserve_seats(user_id, screening_id, [(seat_row, seat_col)])
+    return jsonify(body), code
 
-    try:
-        existing = Reservation.query.filter_by(
-            screening_id=screening_id,
-            seat_row=seat_row,
-            seat_column=seat_col
-        ).filter(Reservation.status.in_(['paid', 'pending'])).first()
+@api.post("/reservations/batch")
+def create_reservations_batch():
+    user_payload, err = check_role(["admin", "editor", "viewer"])
+    if err: return err
 
-        if existing:
-            return jsonify({"ok": False, "error": "Seat already reserved"}), 409
+    user_id = user_payload.get("sub")
+    if not user_id:
+        return jsonify({"ok": False, "error": "Invalid token payload (no sub)"}), 401
 
-    except Exception as e:
-        return jsonify({"ok": False, "error": "System busy"}), 500
+    data = request.get_json()
+    if not data:
+        return jsonify({"ok": False, "error": "Invalid JSON"}), 400
 
-    try:
-        date_str = screening.get("date")
-        time_str = screening.get("time")
-        dt_obj = datetime.now()
-        try:
-            dt_obj = datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
-        except:
-            pass
-
-        new_res = Reservation(
-            user_id=user_id,
-            movie_id=screening.get("movie_id", "unknown"),
-            room_number=screening.get("room_number", "unknown"),
-            screening_id=screening_id,
-            seat_row=seat_row,
-            seat_column=seat_col,
-            screening_datetime=dt_obj,
-            status="pending"
-        )
-        db.session.add(new_res)
-        db.session.commit()
+    screening_id = data.get("screening_id")
+    raw_seats = data.get("seats")
 
-        reservation_id = new_res.id
-    except Exception as e:
-        db.session.rollback()
-        if "ix_unique_seat_reservation" in str(e) or "UniqueViolation" in str(e):
-             return jsonify({"ok": False, "error": "Seat already reserved"}), 409
+    if not screening_id or not isinstance(raw_seats, list) or not raw_seats:
+        return jsonify({"ok": False, "error": "Missing screening_id or seats"}), 400
 
-        return jsonify({"ok": False, "error": "Could not create reservation record"}), 500
+    if len(raw_seats) > MAX_SEATS_PER_ORDER:
+        return jsonify({"ok": False, "error": f"At most {MAX_SEATS_PER_ORDER} seats per order"}), 400
 
-    # Payload for RabbitMQ (payment_worker)
+    try:
+        seats = [(int(seat["row"]), int(seat["col"])) for seat in raw_seats]
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"ok": False, "error": "Invalid seat"}), 400
 
-    price = float(screening.get("price", 15.0))
-    amount_cents = int(price * 100)
+    if len(set(seats)) != len(seats):
+        return jsonify({"ok": False, "error": "Duplicate seat in order"}), 400
 
-    payment_message = {
-        "reservation_id": reservation_id,
-        "user_id": user_id,
-        "amount": amount_cents,
-        "currency": "usd"
-    }
+    body, code = _reserve_seats(user_id, screening_id, seats)
+    return jsonify(body), code
 
-    # Publish
-    try:
-        publish_payment_request(payment_message)
-    except Exception as e:
-        new_res.status = "failed"
-        db.session.commit()
-        return jsonify({"ok": False, "error": "Payment service unavailable"}), 503
+def _encode_cursor(reservation):
+    raw = f"{reservation.created_at.isoformat()}|{reservation.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-    return jsonify({
-        "ok": True,
-        "message": "Reservation initiated",
-        "reservation_id": reservation_id
-    }), 200
+def _decode_cursor(cursor):
+    created_at, res_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    return datetime.fromisoformat(created_at), res_id
 
 @api.get("/reservations/me")
 def get_my_reservations():
@@ -407,16 +489,112 @@ def get_my_reservations():
 
     real_user_id = user_id.get("sub")
 
-    reservations = Reservation.query.filter_by(user_id=real_user_id).order_by(Reservation.created_at.desc()).all()
+    try:
+        limit = min(max(int(request.args.get("limit", RESERVATIONS_PAGE_SIZE)), 1), RESERVATIONS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid limit"}), 400
+
+    # Newest first, keyset on (created_at, id) via ix_reservation_user_created
+    query = Reservation.query.filter_by(user_id=real_user_id)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor_created, cursor_id = _decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({"ok": False, "error": "Invalid cursor"}), 400
+        query = query.filter(tuple_(Reservation.created_at, Reservation.id) < tuple_(cursor_created, cursor_id))
+
+    reservations = query.order_by(Reservation.created_at.desc(), Reservation.id.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(reservations) > limit:
+        reservations = reservations[:limit]
+        next_cursor = _encode_cursor(reservations[-1])
+
+    movies = get_movies(r.movie_id for r in reservations)
 
     results = []
     for r in reservations:
-        movie = get_movie(r.movie_id)
+        movie = movies.get(r.movie_id)
         movie_title = movie.get("title", "Unknown Movie") if movie else "Unknown Movie"
 
         rd = r.to_dict()
         rd["movie_title"] = movie_title
         results.append(rd)
 
-    return jsonify({"ok": True, "data": results})
+    return jsonify({"ok": True, "data": results, "next_cursor": next_cursor})
+
+# --- Entry scans ---
+# The QR code is signed (ticket_codes.py), so a scan is an HMAC check plus one
+# SETBIT on admitted:{screening_id}: no Postgres, no ticket lookup.
+
+def _scan_results(codes, screening_id=None):
+    """Verify codes and admit the valid ones, in order. Returns one result dict per code."""
+    results = [None] * len(codes)
+    admits = []
+    for i, code in enumerate(codes):
+        ticket = verify_ticket_code(code, TICKET_SIGNING_KEYS) if isinstance(code, str) else None
+        if ticket is None:
+            results[i] = {"status": "INVALID"}
+        elif screening_id and ticket.screening_id != screening_id:
+            results[i] = {"status": "WRONG_SCREENING", "screening_id": ticket.screening_id}
+        else:
+            results[i] = {"reservation_id": ticket.reservation_id, "screening_id": ticket.screening_id,
+                          "seat_offset": ticket.seat_offset}
+            admits.append((i, ticket))
+
+    previous = admit_seats([(ticket.screening_id, ticket.seat_offset) for _, ticket in admits])
+    for (i, _), was_admitted in zip(admits, previous):
+        results[i]["status"] = "ALREADY_ADMITTED" if was_admitted else "ADMITTED"
+    return results
 
+_SCAN_STATUS_CODES = {"ADMITTED": 200, "ALREADY_ADMITTED": 409, "WRONG_SCREENING": 409, "INVALID": 400}
+
+@api.post("/scan")
+def scan_ticket():
+    _, err = check_role(["editor"])
+    if err: return err
+
+    if not TICKET_SIGNING_KEYS:
+        return jsonify({"ok": False, "error": "Ticket scanning is not configured"}), 503
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get("code"):
+        return jsonify({"ok": False, "error": "Missing code"}), 400
+
+    # screening_id (optional): the screening this door admits to
+    result = _scan_results([data["code"]], data.get("screening_id"))[0]
+    code = _SCAN_STATUS_CODES[result["status"]]
+    return jsonify({"ok": code == 200, "data": result}), code
+
+@api.post("/scan/batch")
+def scan_tickets_batch():
+    """Sync scans recorded offline: {"screening_id"?, "scans": [{"code", "scanned_at"?}, ...]}.
+
+    Scans are applied oldest first, so when one ticket was scanned twice the first scan
+    is the one admitted. Results come back in request order.
+    """
+    _, err = check_role(["editor"])
+    if err: return err
+
+    if not TICKET_SIGNING_KEYS:
+        return jsonify({"ok": False, "error": "Ticket scanning is not configured"}), 503
+
+    data = request.get_json(silent=True)
+    scans = data.get("scans") if isinstance(data, dict) else None
+    if not isinstance(scans, list) or not scans:
+        return jsonify({"ok": False, "error": "Missing scans"}), 400
+    if len(scans) > SCAN_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"At most {SCAN_BATCH_MAX} scans per batch"}), 400
+
+    try:
+        order = sorted(range(len(scans)), key=lambda i: float(scans[i].get("scanned_at") or 0))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Invalid scan"}), 400
+
+    ordered = _scan_results([scans[i].get("code") for i in order], data.get("screening_id"))
+    results = [None] * len(scans)
+    for i, result in zip(order, ordered):
+        results[i] = result
+    return jsonify({"ok": True, "data": results})
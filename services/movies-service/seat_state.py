@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import base64
+from sqlalchemy import tuple_
+from models import Reservation
+from redis_client import (
+    get_room, seat_offset, get_seat_bitmap, mark_seats, acquire_seat_rebuild, release_seat_rebuild,
+    delete_seat_bitmap, publish_seat_bitmap, get_live_seat_hold_offsets,
+    claim_seat_bits, release_seat_bits, get_expired_seat_holds
+)
+
+ACTIVE_STATUSES = ['paid', 'pending', 'PAID', 'PENDING']
+PENDING_STATUSES = ['pending', 'PENDING']
+
+# How long a claimed seat may stay without a committed reservation row
+SEAT_HOLD_SECONDS = int(os.getenv("SEAT_HOLD_SECONDS", "30"))
+# How long a request waits for another replica's rebuild of the same bitmap
+SEAT_REBUILD_WAIT = float(os.getenv("SEAT_REBUILD_WAIT", "5"))
+
+# Redis holds the live seat map per screening; Postgres stays the source of truth
+# and any bitmap can be rebuilt from it.
+
+def build_seat_bitmap(sid, rows, cols, held=()):
+    # held: offsets of live seat holds, taken even though their rows are not committed yet
+    bitmap = bytearray((rows * cols + 7) // 8)
+    for offset in held:
+        bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+    taken = Reservation.query.with_entities(Reservation.seat_row, Reservation.seat_column).filter(
+        Reservation.screening_id == sid,
+        Reservation.status.in_(ACTIVE_STATUSES)
+    ).all()
+    for row, col in taken:
+        offset = seat_offset(row, col, cols)
+        bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+    return bitmap
+
+def _wait_for_seat_bitmap(sid):
+    deadline = time.time() + SEAT_REBUILD_WAIT
+    while time.time() < deadline:
+        bitmap = get_seat_bitmap(sid)
+        if bitmap is not None:
+            return bitmap
+        time.sleep(0.05)
+    return None
+
+def rebuild_seat_bitmap(sid, room, force=True):
+    """Rebuild the bitmap from Postgres. With force=False an existing bitmap is kept and returned.
+
+    One replica rebuilds at a time; the others wait for its bitmap. The bitmap is taken
+    out of Redis before Postgres is read, so seat changes from then on are journaled and
+    replayed onto the snapshot when it is published.
+    """
+    token = uuid.uuid4().hex
+    if not acquire_seat_rebuild(sid, token):
+        bitmap = _wait_for_seat_bitmap(sid)
+        # Still nothing: serve a snapshot without storing it, the next request retries
+        return bitmap if bitmap is not None else bytes(build_seat_bitmap(sid, room["rows"], room["cols"]))
+
+    try:
+        if not force:
+            bitmap = get_seat_bitmap(sid)
+            if bitmap is not None:
+                release_seat_rebuild(sid, token)
+                return bitmap
+        else:
+            delete_seat_bitmap(sid)
+        # Holds before rows: a hold confirmed after this read has its row committed before the Postgres read
+        held = get_live_seat_hold_offsets(sid)
+        bitmap = build_seat_bitmap(sid, room["rows"], room["cols"], held)
+    except Exception:
+        release_seat_rebuild(sid, token)
+        raise
+
+    if publish_seat_bitmap(sid, bitmap, token):
+        return get_seat_bitmap(sid)
+    return bytes(bitmap)
+
+def load_seat_bitmap(sid, room):
+    bitmap = get_seat_bitmap(sid)
+    if bitmap is None:
+        bitmap = rebuild_seat_bitmap(sid, room, force=False)
+    return bitmap
+
+_BITS_TO_CELLS = bytes.maketrans(b"01", b"\x00\x01")
+
+def bitmap_to_matrix(bitmap, rows, cols):
+    # 0 = Free, 1 = Taken (Reserved/Paid)
+    total = rows * cols
+    # Unpack every bit at once: big int -> '0'/'1' string -> 0/1 bytes, then slice per row
+    nbits = len(bitmap) * 8
+    bits = bin(int.from_bytes(bitmap, "big") | (1 << nbits))[3:]
+    cells = bits[:total].encode().translate(_BITS_TO_CELLS).ljust(total, b"\x00")
+    return [list(cells[r * cols:(r + 1) * cols]) for r in range(rows)]
+
+def bitmap_to_b64(bitmap, rows, cols):
+    # Compact wire format: the raw bitmap, MSB first, row-major, padded/trimmed to the room size
+    size = (rows * cols + 7) // 8
+    return base64.b64encode(bytes(bitmap[:size]).ljust(size, b"\x00")).decode()
+
+def set_seats_taken(sid, room, seats, taken=True):
+    # seats: iterable of (row, col)
+    return mark_seats(sid, [seat_offset(row, col, room["cols"]) for row, col in seats], taken)
+
+def _owned_seat_offsets(sid, cols, offsets):
+    # Offsets among these that a committed active reservation row owns
+    return {
+        seat_offset(row, col, cols)
+        for row, col in Reservation.query.with_entities(Reservation.seat_row, Reservation.seat_column).filter(
+            Reservation.screening_id == sid,
+            Reservation.status.in_(ACTIVE_STATUSES),
+            tuple_(Reservation.seat_row, Reservation.seat_column).in_([divmod(o, cols) for o in offsets])
+        ).all()
+    }
+
+def free_reserved_seats(rows):
+    """Clear the seat bits of reservations that gave their seats up.
+
+    A bit is only cleared while neither a live hold nor an active row owns the seat, so
+    this is safe to run again for rows released before, e.g. on a redelivered result.
+    """
+    # rows: iterable of (screening_id, room_number, seat_row, seat_column)
+    seats = {}
+    for sid, room_number, row, col in rows:
+        seats.setdefault((sid, room_number), []).append((row, col))
+
+    for (sid, room_number), seat_list in seats.items():
+        room = get_room(room_number)
+        if not room:
+            continue
+        offsets = {seat_offset(row, col, room["cols"]) for row, col in seat_list}
+        # Holds before rows, as in rebuild_seat_bitmap: a hold confirmed in between has its row committed
+        offsets -= set(get_live_seat_hold_offsets(sid))
+        offsets -= _owned_seat_offsets(sid, room["cols"], offsets)
+        if offsets:
+            mark_seats(sid, sorted(offsets), taken=False)
+
+# --- Seat holds ---
+# A booking first claims its seats on the bitmap (one Lua call, all or nothing);
+# only the winner goes on to insert into Postgres. The hold is confirmed once the
+# row is committed, released on failure, and freed by the sweeper if it times out.
+
+def claim_seats(sid, room, seats):
+    """Claim seats [(row, col)] for a booking. Returns a hold, or None if any seat is taken."""
+    hold = {
+        "sid": sid,
+        "offsets": [seat_offset(row, col, room["cols"]) for row, col in seats],
+        "hold_id": uuid.uuid4().hex,
+    }
+    deadline = time.time() + SEAT_HOLD_SECONDS
+
+    result = claim_seat_bits(sid, hold["offsets"], hold["hold_id"], deadline)
+    if result == -1:
+        load_seat_bitmap(sid, room)
+        result = claim_seat_bits(sid, hold["offsets"], hold["hold_id"], deadline)
+    return hold if result == 1 else None
+
+def confirm_seat_hold(hold):
+    # The reservation row owns the seats now; keep the bits, drop the hold
+    release_seat_bits(hold["sid"], hold["offsets"], hold["hold_id"], free_seats=False)
+
+def release_seat_hold(hold):
+    release_seat_bits(hold["sid"], hold["offsets"], hold["hold_id"], free_seats=True)
+
+def release_conflicting_seat_hold(hold, room):
+    """Drop a hold whose insert hit the unique seat index.
+
+    Seats a committed row already owns keep their bit (set again from that row); only the
+    rest are freed. Other bookings' holds and bits are left alone.
+    """
+    owned = _owned_seat_offsets(hold["sid"], room["cols"], hold["offsets"])
+    release_seat_bits(hold["sid"], [o for o in hold["offsets"] if o not in owned], hold["hold_id"], free_seats=True)
+    release_seat_bits(hold["sid"], [o for o in hold["offsets"] if o in owned], hold["hold_id"], free_seats=False)
+    mark_seats(hold["sid"], sorted(owned))
+
+def release_expired_seat_holds():
+    holds = {}
+    for sid, offset, hold_id in get_expired_seat_holds():
+        holds.setdefault((sid, hold_id), []).append(offset)
+
+    freed = 0
+    for (sid, hold_id), offsets in holds.items():
+        freed += release_seat_bits(sid, offsets, hold_id, free_seats=True)
+    return freed
@@ -0,0 +1,39 @@
+# Shared by ticket-service (signs) and movies-service (verifies): keep the copies identical.
+import hmac
+import base64
+import hashlib
+from typing import NamedTuple, Optional, Sequence
+
+# Signed ticket QR payloads, verifiable at the door without any lookup:
+#   T1.{reservation_id}.{screening_id}.{seat_offset}.{signature}
+# signature = base64url(HMAC-SHA256(key, everything before it))[:22], i.e. 132 bits.
+
+VERSION = "T1"
+SIGNATURE_LENGTH = 22
+
+class TicketCode(NamedTuple):
+    reservation_id: str
+    screening_id: str
+    seat_offset: int
+
+def _signature(key: bytes, message: str) -> str:
+    digest = hmac.new(key, message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode()[:SIGNATURE_LENGTH]
+
+def sign_ticket_code(key: bytes, reservation_id: str, screening_id: str, seat_offset: int) -> str:
+    message = f"{VERSION}.{reservation_id}.{screening_id}.{int(seat_offset)}"
+    return f"{message}.{_signature(key, message)}"
+
+def verify_ticket_code(code: str, keys: Sequence[bytes]) -> Optional[TicketCode]:
+    """Parse and check a scanned code against the current and previous keys. None if invalid."""
+    message, _, signature = code.strip().rpartition(".")
+    parts = message.split(".")
+    if len(parts) != 4 or parts[0] != VERSION or len(signature) != SIGNATURE_LENGTH:
+        return None
+    if not any(hmac.compare_digest(_signature(key, message), signature) for key in keys):
+        return None
+
+    _, reservation_id, screening_id, seat_offset = parts
+    if not seat_offset.isdigit():
+        return None
+    return TicketCode(reservation_id, screening_id, int(seat_offset))
@@ -0,0 +1,70 @@
+import time
+import threading
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Trips on the provider error rate over the last `window` calls.
+
+    closed -> open once at least min_calls were recorded and the error rate reaches
+    threshold; open -> half_open after cooldown (via try_half_open); half_open ->
+    closed on the next success, or back to open on a failure. on_change(state) is
+    called outside the lock on every transition.
+    """
+
+    def __init__(self, window: int = 50, min_calls: int = 10, threshold: float = 0.5,
+                 cooldown: float = 30.0, on_change=None):
+        self._min_calls = min_calls
+        self._threshold = threshold
+        self.cooldown = cooldown
+        self.on_change = on_change
+
+        self._lock = threading.Lock()
+        self._results: deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self.state = CLOSED
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._results:
+                return 0.0
+            return self._results.count(False) / len(self._results)
+
+    def _transition(self, state: str) -> None:
+        # Caller holds the lock
+        self.state = state
+        self._results.clear()
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            before = self.state
+            if before == OPEN:
+                # Stragglers from before the trip say nothing about the provider now
+                return
+            if before == HALF_OPEN:
+                self._transition(CLOSED if ok else OPEN)
+            else:
+                self._results.append(ok)
+                failures = self._results.count(False)
+                if len(self._results) >= self._min_calls and failures / len(self._results) >= self._threshold:
+                    self._transition(OPEN)
+            after = self.state
+
+        if after != before and self.on_change:
+            self.on_change(after)
+
+    def try_half_open(self) -> bool:
+        """Let a probe through once the cooldown is over. True if the breaker moved to half-open."""
+        with self._lock:
+            if self.state != OPEN or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._transition(HALF_OPEN)
+
+        if self.on_change:
+            self.on_change(HALF_OPEN)
+        return True
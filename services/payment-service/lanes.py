@@ -0,0 +1,45 @@
+from collections import deque
+
+class LaneScheduler:
+    """Buffers work per lane and picks the next item by smooth weighted round robin.
+
+    Only lanes with work compete, so an idle urgent lane costs the others nothing,
+    and under saturation every lane still gets its share of weight / total: low
+    lanes slow down but never starve. Ties go to the lane listed first. Not
+    thread-safe; the payment worker only uses it on the connection thread.
+    """
+
+    def __init__(self, weights: dict[str, int]):
+        self._weights = dict(weights)
+        self._current = {lane: 0 for lane in weights}
+        self._items = {lane: deque() for lane in weights}
+
+    def push(self, lane: str, item) -> None:
+        self._items[lane].append(item)
+
+    def pop(self):
+        """Return (lane, item) for the next item to serve, or None if every lane is empty."""
+        ready = [lane for lane, items in self._items.items() if items]
+        if not ready:
+            return None
+
+        total = 0
+        for lane in ready:
+            self._current[lane] += self._weights[lane]
+            total += self._weights[lane]
+        best = max(ready, key=lambda lane: self._current[lane])
+        self._current[best] -= total
+        return best, self._items[best].popleft()
+
+    def drain(self):
+        """Remove and return every buffered (lane, item)."""
+        drained = [(lane, item) for lane, items in self._items.items() for item in items]
+        for items in self._items.values():
+            items.clear()
+        return drained
+
+    def depth(self) -> dict[str, int]:
+        return {lane: len(items) for lane, items in self._items.items()}
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._items.values())
@@ -0,0 +1,17 @@
+import threading
+
+# Per-process counters and gauges, served as JSON on /metrics
+_lock = threading.Lock()
+_values = {}
+
+def incr(name, amount=1):
+    with _lock:
+        _values[name] = _values.get(name, 0) + amount
+
+def set_value(name, value):
+    with _lock:
+        _values[name] = value
+
+def snapshot():
+    with _lock:
+        return dict(_values)
@@ -1,8 +1,17 @@
 import os
 import json
 import time
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import pika
+import redis
+import requests
 import stripe
+import metrics
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from lanes import LaneScheduler
 
 def _get_env(name: str) -> str:
     value = os.getenv(name)
@@ -17,12 +26,102 @@ MQ_EXCHANGE_EVENTS = _get_env("MQ_EXCHANGE_EVENTS")
 STRIPE_API_KEY = _get_env("STRIPE_API_KEY")
 STRIPE_API_BASE = _get_env("STRIPE_API_BASE")
 
+REDIS_HOST = _get_env("REDIS_HOST")
+REDIS_PORT = int(_get_env("REDIS_PORT"))
+
+# Charges in flight per worker: prefetch and thread pool size
+PAYMENT_CONCURRENCY = int(os.getenv("PAYMENT_CONCURRENCY", "8"))
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "30"))
+
+# A request is failed without charging once its hold is this close to expires_at: the
+# janitor may expire the rows (and free the seats) before a later charge is reported back
+PAYMENT_EXPIRY_MARGIN = float(os.getenv("PAYMENT_EXPIRY_MARGIN", str(STRIPE_TIMEOUT + 30)))
+
+# Dedup of redelivered requests, keyed by reservation_id
+PAYMENT_RESULT_TTL = int(os.getenv("PAYMENT_RESULT_TTL", str(7 * 24 * 3600)))
+PAYMENT_LOCK_TTL = int(os.getenv("PAYMENT_LOCK_TTL", str(int(STRIPE_TIMEOUT) * 2)))
+PREFIX_PAYMENT_RESULT = "payment_result" # key: payment_result:{reservation_id} -> result event JSON
+PREFIX_PAYMENT_LOCK = "payment_lock" # key: payment_lock:{reservation_id} -> set while a worker charges it
+
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+# Transient Stripe errors wait in TTL queues that dead-letter back into the request
+# queue: attempt n waits PAYMENT_RETRY_BASE_SECONDS * 2^(n-1), then the order fails
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+PAYMENT_RETRY_BASE_SECONDS = int(os.getenv("PAYMENT_RETRY_BASE_SECONDS", "5"))
+RETRY_DELAYS = [PAYMENT_RETRY_BASE_SECONDS * 2 ** tier for tier in range(PAYMENT_MAX_ATTEMPTS - 1)]
+HEADER_ATTEMPT = "x-payment-attempt"
+
+# Consumption pauses while the provider error rate is above the threshold
+PAYMENT_BREAKER_WINDOW = int(os.getenv("PAYMENT_BREAKER_WINDOW", "50"))
+PAYMENT_BREAKER_MIN_CALLS = int(os.getenv("PAYMENT_BREAKER_MIN_CALLS", "10"))
+PAYMENT_BREAKER_THRESHOLD = float(os.getenv("PAYMENT_BREAKER_THRESHOLD", "0.5"))
+PAYMENT_BREAKER_COOLDOWN = float(os.getenv("PAYMENT_BREAKER_COOLDOWN", "30"))
+
+# Request lanes by time to showtime (movies-service mq_utils picks the lane). Weights
+# are the share of charge slots each lane gets while all are backed up
+LANE_URGENT = f"{MQ_QUEUE_REQUESTS}.urgent"
+LANE_NORMAL = MQ_QUEUE_REQUESTS
+LANE_LATER = f"{MQ_QUEUE_REQUESTS}.later"
+PAYMENT_LANE_WEIGHTS = [int(w) for w in os.getenv("PAYMENT_LANE_WEIGHTS", "8,3,1").split(",")]
+LANE_WEIGHTS = dict(zip([LANE_URGENT, LANE_NORMAL, LANE_LATER], PAYMENT_LANE_WEIGHTS))
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+RETRY_DEPTH_INTERVAL = 5
+
+breaker = CircuitBreaker(
+    window=PAYMENT_BREAKER_WINDOW,
+    min_calls=PAYMENT_BREAKER_MIN_CALLS,
+    threshold=PAYMENT_BREAKER_THRESHOLD,
+    cooldown=PAYMENT_BREAKER_COOLDOWN
+)
+
+# Provider trouble worth retrying; declines and invalid requests are final.
+# APIError (a Stripe 5xx) is final too: Stripe stores that response under the idempotency
+# key and replays it to every retry, and a fresh key per attempt could charge twice when
+# the failed request did go through. The order fails and the user can book again
+TRANSIENT_STRIPE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.RateLimitError,
+)
+
+class TransientPaymentError(Exception):
+    pass
+
 stripe.api_key = STRIPE_API_KEY
 stripe.api_base = STRIPE_API_BASE
 
-def process_payment_request(ch, method, properties, body):
-    payload = json.loads(body)
-    print(f" [MQ] Received payment request: {payload}")
+def _stripe_session():
+    # One keep-alive pool shared by every charge thread, sized so none waits for a socket
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PAYMENT_CONCURRENCY)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=STRIPE_TIMEOUT, session=_stripe_session())
+
+def result_event(payload, status):
+    # Multi-seat orders carry every reservation id; one charge covers them all.
+    # Screening and seat offsets are passed through for the signed ticket QR codes
+    return {
+        "reservation_id": payload["reservation_id"],
+        "reservation_ids": payload.get("reservation_ids") or [payload["reservation_id"]],
+        "user_id": payload["user_id"],
+        "status": status,
+        "amount": payload.get("amount"),
+        "screening_id": payload.get("screening_id"),
+        "seat_offsets": payload.get("seat_offsets"),
+        "timestamp": time.time()
+    }
+
+def charge(payload):
+    """Run the Stripe charge for one payment request and return the result event. Thread-safe.
+
+    The charge carries an idempotency key, so Stripe itself never charges a reservation twice.
+    Raises TransientPaymentError when the provider, not the card, is the problem.
+    """
+    reservation_ids = payload.get("reservation_ids") or [payload["reservation_id"]]
 
     try:
         # Simulate call to Stripe
@@ -30,26 +129,91 @@ def process_payment_request(ch, method, properties, body):
             amount=payload.get("amount", 1000),
             currency=payload.get("currency", "usd"),
             source="tok_visa",
-            description=f"Reservation {payload.get('reservation_id')}"
+            description=f"Reservation {', '.join(reservation_ids)}",
+            idempotency_key=f"reservation-{payload['reservation_id']}"
         )
         status = "PAID"
+    except TRANSIENT_STRIPE_ERRORS as e:
+        print(f" [Stripe] Transient error: {e}")
+        breaker.record(False)
+        raise TransientPaymentError(str(e)) from e
+    except stripe.error.APIError as e:
+        # Final (see TRANSIENT_STRIPE_ERRORS), but still a provider failure for the breaker
+        print(f" [Stripe] Provider error: {e}")
+        breaker.record(False)
+        return result_event(payload, "FAILED")
     except Exception as e:
         print(f" [Stripe] Error: {e}")
         status = "FAILED"
 
-    result_event = {
-        "reservation_id": payload["reservation_id"],
-        "user_id": payload["user_id"],
-        "status": status,
-        "amount": payload.get("amount"),
-        "timestamp": time.time()
-    }
-    
-    publish_result(ch, result_event)
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    breaker.record(True)
+    return result_event(payload, status)
+
+def hold_expired(payload, now=None):
+    # Requests published before expires_at was added carry none: charge them as before
+    expires_at = payload.get("expires_at")
+    if not isinstance(expires_at, (int, float)):
+        return False
+    return (time.time() if now is None else now) >= expires_at - PAYMENT_EXPIRY_MARGIN
+
+def process_payment(payload, last_attempt=True):
+    """Charge a request once per reservation_id. Returns the result event, or None if another worker has it.
+
+    A request already settled replays its stored result instead of calling Stripe, and
+    one whose seat hold has (nearly) expired fails without calling it.
+    Redis being down only costs the shortcut; the Stripe idempotency key still holds.
+    A transient error raises TransientPaymentError, unless this is the last attempt
+    and the order is failed instead.
+    """
+    rid = payload["reservation_id"]
+    result_key = f"{PREFIX_PAYMENT_RESULT}:{rid}"
+    lock_key = f"{PREFIX_PAYMENT_LOCK}:{rid}"
+
+    locked = False
+    try:
+        stored = r.get(result_key)
+        if stored:
+            print(f" [Worker] Duplicate request for {rid}, replaying stored result")
+            return json.loads(stored)
+        locked = r.set(lock_key, "1", nx=True, ex=PAYMENT_LOCK_TTL)
+        if not locked:
+            # In progress on another worker; if that one dies its own delivery comes back
+            print(f" [Worker] Request for {rid} already in progress, dropping duplicate")
+            return None
+    except redis.RedisError as e:
+        print(f" [Redis] Dedup unavailable, charging anyway: {e}")
+
+    try:
+        if hold_expired(payload):
+            # Waited too long in the queue or the retry backlog: the seats are not ours any more
+            print(f" [Worker] Hold on {rid} expired before charging, failing it")
+            metrics.incr("payments_expired_total")
+            event = result_event(payload, "FAILED")
+        else:
+            event = charge(payload)
+    except TransientPaymentError:
+        if not last_attempt:
+            if locked:
+                try:
+                    r.delete(lock_key)
+                except redis.RedisError:
+                    pass # expires on its own
+            raise
+        print(f" [Worker] Giving up on {rid} after {PAYMENT_MAX_ATTEMPTS} attempts")
+        metrics.incr("payment_retries_exhausted_total")
+        event = result_event(payload, "FAILED")
+
+    try:
+        pipe = r.pipeline()
+        pipe.set(result_key, json.dumps(event), ex=PAYMENT_RESULT_TTL)
+        if locked:
+            pipe.delete(lock_key)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f" [Redis] Could not store result for {rid}: {e}")
+    return event
 
 def publish_result(ch, event):
-    ch.exchange_declare(exchange=MQ_EXCHANGE_EVENTS, exchange_type='fanout')
     ch.basic_publish(
         exchange=MQ_EXCHANGE_EVENTS,
         routing_key='',
@@ -57,19 +221,206 @@ def publish_result(ch, event):
     )
     print(f" [MQ] Published event: {event['status']}")
 
+
+def retry_queue(lane, tier):
+    return f"{lane}.retry.{tier}"
+
+def declare_retry_queues(channel, lane):
+    # One queue per delay: a per-queue TTL expires in FIFO order, unlike per-message TTLs.
+    # Each lane has its own, so a retried request comes back in its own lane
+    for tier, delay in enumerate(RETRY_DELAYS):
+        channel.queue_declare(queue=retry_queue(lane, tier), durable=True, arguments={
+            "x-message-ttl": delay * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": lane,
+        })
+
+def schedule_retry(ch, lane, delivery_tag, body, attempt):
+    tier = attempt - 1
+    ch.basic_publish(
+        exchange='',
+        routing_key=retry_queue(lane, tier),
+        body=body,
+        properties=pika.BasicProperties(delivery_mode=2, headers={HEADER_ATTEMPT: attempt + 1})
+    )
+    ch.basic_ack(delivery_tag=delivery_tag)
+    metrics.incr("payment_retries_scheduled_total")
+    print(f" [Worker] Attempt {attempt} failed, retrying in {RETRY_DELAYS[tier]}s")
+
+def finish_payment(ch, delivery_tag, event):
+    # Runs on the connection thread. Acks are per delivery tag, so charges may finish in any order
+    publish_result(ch, event)
+    ch.basic_ack(delivery_tag=delivery_tag)
+    metrics.incr(f"payments_{event['status'].lower()}_total")
+
+class PaymentConsumer:
+    """One connection's consumer: charges on the pool, pika calls on the connection thread.
+
+    Every lane is consumed into a LaneScheduler buffer, and requests are handed to the
+    pool in lane order whenever a charge slot is free.
+    """
+
+    def __init__(self, connection, pool):
+        self.connection = connection
+        self.channel = connection.channel()
+        self.pool = pool
+        self.consumer_tags = []
+        self.scheduler = LaneScheduler(LANE_WEIGHTS)
+        self.in_flight = 0
+        self.max_in_flight = PAYMENT_CONCURRENCY
+
+        self.channel.exchange_declare(exchange=MQ_EXCHANGE_EVENTS, exchange_type='fanout')
+        for lane in LANE_WEIGHTS:
+            self.channel.queue_declare(queue=lane, durable=True)
+            declare_retry_queues(self.channel, lane)
+
+    def threadsafe(self, callback):
+        # pika is not thread-safe: everything touching the channel runs on the connection thread
+        try:
+            self.connection.add_callback_threadsafe(callback)
+        except Exception as e:
+            # Connection gone: unacked requests are redelivered after reconnecting
+            print(f" [Worker] Dropped callback, connection lost: {e}")
+
+    def on_request(self, lane, ch, method, properties, body):
+        self.scheduler.push(lane, (method, properties, body))
+        self.dispatch()
+
+    def dispatch(self):
+        while self.in_flight < self.max_in_flight:
+            picked = self.scheduler.pop()
+            if picked is None:
+                return
+            lane, (method, properties, body) = picked
+            self.in_flight += 1
+            self.start(lane, method.delivery_tag, properties, body)
+
+    def complete(self, callback):
+        try:
+            callback()
+        finally:
+            self.in_flight -= 1
+            self.dispatch()
+
+    def start(self, lane, delivery_tag, properties, body):
+        ch = self.channel
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            print(f" [MQ] Dropping malformed payment request: {body[:200]!r}")
+            self.complete(functools.partial(ch.basic_ack, delivery_tag=delivery_tag))
+            return
+        attempt = int((properties.headers or {}).get(HEADER_ATTEMPT, 1))
+        print(f" [MQ] Received payment request ({lane}, attempt {attempt}): {payload}")
+
+        def work():
+            try:
+                event = process_payment(payload, last_attempt=attempt >= PAYMENT_MAX_ATTEMPTS)
+                if event is None:
+                    callback = functools.partial(ch.basic_ack, delivery_tag=delivery_tag)
+                else:
+                    callback = functools.partial(finish_payment, ch, delivery_tag, event)
+            except TransientPaymentError:
+                callback = functools.partial(schedule_retry, ch, lane, delivery_tag, body, attempt)
+            except Exception as e:
+                print(f" [Worker] Dropping unprocessable request {payload}: {e}")
+                callback = functools.partial(ch.basic_ack, delivery_tag=delivery_tag)
+            self.threadsafe(functools.partial(self.complete, callback))
+
+        self.pool.submit(work)
+
+    def resume(self, max_in_flight):
+        # Each lane buffers at most max_in_flight; the scheduler only picks among what is here.
+        # Prefetch is fixed per consumer when it starts, so a new limit needs new consumers
+        if self.consumer_tags and max_in_flight != self.max_in_flight:
+            self.pause()
+        self.max_in_flight = max_in_flight
+        self.channel.basic_qos(prefetch_count=max_in_flight)
+        if not self.consumer_tags:
+            for lane in LANE_WEIGHTS:
+                self.consumer_tags.append(self.channel.basic_consume(
+                    queue=lane, on_message_callback=functools.partial(self.on_request, lane)
+                ))
+        self.dispatch()
+
+    def pause(self):
+        # Buffered requests go back to their queues; in-flight ones finish
+        for tag in self.consumer_tags:
+            self.channel.basic_cancel(tag)
+        self.consumer_tags = []
+        for lane, (method, properties, body) in self.scheduler.drain():
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    def apply_breaker_state(self, state=None):
+        state = state or breaker.state
+        metrics.set_value("payment_breaker_state", state)
+        if state == OPEN:
+            print(f" [Breaker] Provider error rate too high, pausing for {breaker.cooldown:.0f}s")
+            self.pause()
+            self.connection.call_later(breaker.cooldown, self.probe)
+        elif state == HALF_OPEN:
+            # A single request decides whether the provider is back
+            print(" [Breaker] Half-open, letting one request through")
+            self.resume(max_in_flight=1)
+        else:
+            print(" [Breaker] Closed, consuming normally")
+            self.resume(max_in_flight=PAYMENT_CONCURRENCY)
+
+    def probe(self):
+        if not breaker.try_half_open() and breaker.state == OPEN:
+            self.connection.call_later(1, self.probe)
+
+    def refresh_queue_depth(self):
+        lane_depth, retry_depth = {}, {}
+        for lane in LANE_WEIGHTS:
+            lane_depth[lane] = self.channel.queue_declare(queue=lane, passive=True).method.message_count
+            for tier in range(len(RETRY_DELAYS)):
+                queue = retry_queue(lane, tier)
+                retry_depth[queue] = self.channel.queue_declare(queue=queue, passive=True).method.message_count
+        metrics.set_value("payment_lane_depth", lane_depth)
+        metrics.set_value("payment_retry_depth", retry_depth)
+        metrics.set_value("payment_breaker_error_rate", round(breaker.error_rate(), 3))
+        self.connection.call_later(RETRY_DEPTH_INTERVAL, self.refresh_queue_depth)
+
+    def run(self):
+        # Transitions happen on charge threads; apply them on this one
+        breaker.on_change = lambda state: self.threadsafe(functools.partial(self.apply_breaker_state, state))
+        self.apply_breaker_state()
+        self.refresh_queue_depth()
+
+        print(f" [Worker] Waiting for requests ({PAYMENT_CONCURRENCY} in flight max)...")
+        # Not start_consuming(): it returns as soon as the breaker cancels the consumers
+        while True:
+            self.connection.process_data_events(time_limit=1)
+
+def start_metrics_server(port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = json.dumps({"ok": True, "data": metrics.snapshot()}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f" [Worker] Metrics on :{port}/metrics")
+
 def run():
     print(f" [Worker] Connecting to {RABBITMQ_HOST}...")
+    start_metrics_server(METRICS_PORT)
+    pool = ThreadPoolExecutor(max_workers=PAYMENT_CONCURRENCY, thread_name_prefix="charge")
     while True:
         try:
             connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-            channel = connection.channel()
-
-            channel.queue_declare(queue=MQ_QUEUE_REQUESTS, durable=True)
-            channel.basic_qos(prefetch_count=1)
-            channel.basic_consume(queue=MQ_QUEUE_REQUESTS, on_message_callback=process_payment_request)
-
-            print(" [Worker] Waiting for requests...")
-            channel.start_consuming()
+            PaymentConsumer(connection, pool).run()
         except pika.exceptions.AMQPConnectionError:
             print(" [Worker] Connection failed, retrying in 5s...")
             time.sleep(5)
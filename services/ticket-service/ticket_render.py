@@ -0,0 +1,137 @@
+import io
+import os
+import qrcode
+from reportlab.graphics import renderPDF
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from ticket_codes import sign_ticket_code
+
+# Runs inside the render process pool: keep it free of Flask/pika state.
+#
+# Template overlay: everything that is the same on every ticket is built once per
+# process as a Drawing. Each document stamps it into a form XObject (a PDF cannot
+# point into another), and each page only references that and stamps the
+# reservation id, user id and a vector QR code on top.
+
+FONT = "Helvetica"
+FONT_SIZE = 12
+LEFT = 100
+TEMPLATE_FORM = "ticket_template"
+TEMPLATE_TEXT = [
+    (800, "CINEMA TICKET"),
+    (740, "Status: PAID"),
+]
+# (y, static label, event field): the value is stamped right after the label
+TEMPLATE_FIELDS = [
+    (780, "Reservation ID: ", "reservation_id"),
+    (760, "User ID: ", "user_id"),
+]
+QR_X, QR_Y, QR_SIZE = 100, 500, 100
+# Read by every render process from its environment; ticket_service refuses to start without it
+TICKET_SIGNING_KEY = os.getenv("TICKET_SIGNING_KEY", "").encode()
+
+# Template and field positions built once per process, both from the same layout, so
+# a stamped value always starts where its label ends
+def _build_template():
+    drawing = Drawing(0, 0)
+    for y, text in TEMPLATE_TEXT:
+        drawing.add(String(LEFT, y, text, fontName=FONT, fontSize=FONT_SIZE))
+    for y, label, _ in TEMPLATE_FIELDS:
+        drawing.add(String(LEFT, y, label, fontName=FONT, fontSize=FONT_SIZE))
+    field_x = {field: LEFT + stringWidth(label, FONT, FONT_SIZE) for _, label, field in TEMPLATE_FIELDS}
+    return drawing, field_x
+
+_TEMPLATE, _FIELD_X = _build_template()
+
+def ticket_filename(res_id):
+    return f"ticket_{res_id}.pdf"
+
+def order_filename(res_id):
+    return f"order_{res_id}.pdf"
+
+def qr_payload(data):
+    # Signed, offline-verifiable code when the event knows the seat; events from before
+    # seat offsets were published keep the bare reservation id
+    if data.get("screening_id") and data.get("seat_offset") is not None:
+        return sign_ticket_code(TICKET_SIGNING_KEY, data["reservation_id"], data["screening_id"], data["seat_offset"])
+    return str(data.get("reservation_id"))
+
+def _define_template(c):
+    c.beginForm(TEMPLATE_FORM)
+    renderPDF.draw(_TEMPLATE, c, 0, 0)
+    c.endForm()
+
+def _draw_qr(c, text, x, y, size):
+    # Same code as qrcode.make (version fit, level M, 4-module border), drawn as filled
+    # rectangles, one per horizontal run of dark modules, instead of an embedded bitmap
+    qr = qrcode.QRCode()
+    qr.add_data(text)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+
+    # Work in module units (origin top-left, y down) so every rectangle is small integers
+    n = len(matrix)
+    c.saveState()
+    c.translate(x, y + size)
+    c.scale(size / n, -size / n)
+    path = c.beginPath()
+    for r, row in enumerate(matrix):
+        col = 0
+        while col < n:
+            if not row[col]:
+                col += 1
+                continue
+            start = col
+            while col < n and row[col]:
+                col += 1
+            path.rect(start, r, col - start, 1)
+    c.drawPath(path, stroke=0, fill=1)
+    c.restoreState()
+
+def render_tickets_pdf(tickets):
+    """Render tickets to one PDF, a page per ticket, sharing a single copy of the template."""
+    buf = io.BytesIO()
+    # invariant: no timestamps or random ids, so a re-render is byte-identical (stable ETags)
+    c = canvas.Canvas(buf, invariant=1)
+    _define_template(c)
+    for data in tickets:
+        c.doForm(TEMPLATE_FORM)
+        c.setFont(FONT, FONT_SIZE)
+        for y, _, field in TEMPLATE_FIELDS:
+            c.drawString(_FIELD_X[field], y, str(data.get(field)))
+        _draw_qr(c, qr_payload(data), QR_X, QR_Y, QR_SIZE)
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+def render_ticket_pdf(data):
+    return render_tickets_pdf([data])
+
+def write_durably(path, content):
+    """Write content to path atomically: temp file, fsync, rename, fsync of the directory."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # The rename itself is only durable once the directory entry is on disk
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def render_ticket(data, path):
+    """Render and durably store the ticket of one reservation at path. Returns the path."""
+    write_durably(path, render_ticket_pdf(data))
+    return path
+
+def render_order(tickets, path):
+    """Render and durably store every ticket of a multi-seat order as one PDF at path. Returns the path."""
+    write_durably(path, render_tickets_pdf(tickets))
+    return path
@@ -1,11 +1,19 @@
 import os
 import json
+import hashlib
 import time
+import functools
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 import pika
-import qrcode
-from flask import Flask, send_from_directory
-from reportlab.pdfgen import canvas
+from flask import Flask, Response, abort, jsonify, request, send_file
+from ticket_render import ticket_filename, render_ticket, render_order
+from ticket_store import (
+    TICKETS_DIR, RESERVATION_ID_PATTERN, parse_filename, pdf_path, order_pdf_path, legacy_pdf_path,
+    save_event, load_event, is_downloadable, touch, evict_cache
+)
 
 app = Flask(__name__)
 
@@ -17,38 +25,141 @@ def _get_env(name: str) -> str:
 
 RABBITMQ_HOST = _get_env("RABBITMQ_HOST")
 MQ_EXCHANGE_EVENTS = _get_env("MQ_EXCHANGE_EVENTS")
-TICKETS_DIR = "/app/tickets"
+# PAID orders movies-service accepted. Not the raw payment events: a charge that lands
+# after the reservation expired is rejected there and must not get a ticket
+MQ_QUEUE_TICKETS = os.getenv("MQ_QUEUE_TICKETS", "q_tickets_generation")
+# Signs the ticket QR codes (ticket_render reads it in each render process)
+TICKET_SIGNING_KEY = _get_env("TICKET_SIGNING_KEY")
+# TICKET_READY events go out on this fanout exchange
+MQ_EXCHANGE_TICKETS = os.getenv("MQ_EXCHANGE_TICKETS", "ticket_events")
+TICKET_STATUS_MAX_IDS = int(os.getenv("TICKET_STATUS_MAX_IDS", "100"))
+# eager: render every PAID ticket up front. lazy: only store the event and render
+# on the first download
+TICKET_RENDER_MODE = os.getenv("TICKET_RENDER_MODE", "eager")
+TICKET_RENDER_TIMEOUT = float(os.getenv("TICKET_RENDER_TIMEOUT", "30"))
+# Retry-After (seconds) when an on-demand render timed out or its worker died
+TICKET_RENDER_RETRY_AFTER = int(os.getenv("TICKET_RENDER_RETRY_AFTER", "5"))
+TICKET_CACHE_SWEEP_INTERVAL = int(os.getenv("TICKET_CACHE_SWEEP_INTERVAL", "300"))
+# Ticket PDFs never change once rendered: browsers may keep them for a year
+TICKET_MAX_AGE = int(os.getenv("TICKET_MAX_AGE", str(365 * 24 * 3600)))
+# "": Flask streams the file. "x-accel": nginx serves it from TICKET_ACCEL_PREFIX
+# (an internal location aliased to TICKETS_DIR). "x-sendfile": Apache/lighttpd serve it
+TICKET_SENDFILE_MODE = os.getenv("TICKET_SENDFILE_MODE", "")
+TICKET_ACCEL_PREFIX = os.getenv("TICKET_ACCEL_PREFIX", "/protected-tickets/").rstrip("/")
+app.config["USE_X_SENDFILE"] = TICKET_SENDFILE_MODE == "x-sendfile"
+
+# PDF rendering is CPU bound: it runs in worker processes, fed by the consumer thread
+TICKET_RENDER_PROCESSES = int(os.getenv("TICKET_RENDER_PROCESSES", str(os.cpu_count() or 1)))
+# Events rendering at once; the broker holds back the rest
+TICKET_MAX_IN_FLIGHT = int(os.getenv("TICKET_MAX_IN_FLIGHT", str(TICKET_RENDER_PROCESSES * 2)))
 
 if not os.path.exists(TICKETS_DIR):
     os.makedirs(TICKETS_DIR)
 
-def generate_ticket(data):
+_render_pool = None
+
+def get_render_pool():
+    global _render_pool
+    if _render_pool is None:
+        # spawn, not fork: this process already runs pika and Flask threads
+        _render_pool = ProcessPoolExecutor(
+            max_workers=TICKET_RENDER_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _render_pool
+
+def discard_render_pool(pool):
+    # A worker died (e.g. OOM killed): every later submit would fail, start a fresh pool instead
+    global _render_pool
+    if _render_pool is pool:
+        _render_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def split_tickets(data):
+    """One ticket per seat of an order event, each with its own reservation id and seat offset."""
+    res_ids = data.get("reservation_ids") or [data.get("reservation_id")]
+    offsets = data.get("seat_offsets") or []
+    if len(offsets) != len(res_ids):
+        offsets = [None] * len(res_ids)
+    return [{**data, "reservation_id": res_id, "seat_offset": offset} for res_id, offset in zip(res_ids, offsets)]
+
+def submit_tickets(data):
+    """Store the event of every seat of a PAID order and, in eager mode, queue its render.
+
+    Returns (tickets, render futures, pool); no futures in lazy mode.
+    """
     if data.get("status") != "PAID":
-        return
+        return [], [], None
 
-    res_id = data.get("reservation_id")
-    filename = f"ticket_{res_id}.pdf"
-    filepath = os.path.join(TICKETS_DIR, filename)
+    tickets = split_tickets(data)
+    # Durable before the ack, so any ticket can be rendered (again) later
+    for ticket in tickets:
+        save_event(ticket)
+    if TICKET_RENDER_MODE == "lazy":
+        return tickets, [], None
 
-    print(f" [Ticket] Generating PDF for {res_id}...")
+    pool = get_render_pool()
+    print(f" [Ticket] Generating PDFs for {data.get('reservation_id')}...")
+    try:
+        futures = [pool.submit(render_ticket, ticket, pdf_path(ticket["reservation_id"])) for ticket in tickets]
+    except BrokenProcessPool:
+        discard_render_pool(pool)
+        raise
+    return tickets, futures, pool
 
-    c = canvas.Canvas(filepath)
-    c.drawString(100, 800, "CINEMA TICKET")
-    c.drawString(100, 780, f"Reservation ID: {res_id}")
-    c.drawString(100, 760, f"User ID: {data.get('user_id')}")
-    c.drawString(100, 740, "Status: PAID")
+def publish_ticket_ready(ch, tickets):
+    for ticket in tickets:
+        ch.basic_publish(
+            exchange=MQ_EXCHANGE_TICKETS,
+            routing_key='',
+            body=json.dumps({
+                "type": "TICKET_READY",
+                "reservation_id": ticket["reservation_id"],
+                "user_id": ticket.get("user_id"),
+                "filename": ticket_filename(ticket["reservation_id"]),
+                "timestamp": time.time()
+            }),
+            properties=pika.BasicProperties(delivery_mode=2)
+        )
 
-    qr_path = os.path.join(TICKETS_DIR, f"qr_{res_id}.png")
-    qr = qrcode.make(res_id)
-    qr.save(qr_path)
+def settle_when_done(connection, ch, delivery_tag, tickets, futures, pool):
+    """Ack the event once every ticket is on disk and announce the rendered ones;
+    requeue it if the disk or the pool failed."""
+    remaining = [len(futures)]
+    lock = threading.Lock()
 
-    c.drawImage(qr_path, 100, 500, width=100, height=100)
-    c.save()
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
 
-    if os.path.exists(qr_path):
-        os.remove(qr_path)
+        retry = False
+        ready = []
+        for ticket, future in zip(tickets, futures):
+            error = future.exception()
+            if error is None:
+                print(f" [Ticket] Saved: {future.result()}")
+                ready.append(ticket)
+                continue
+            print(f" [Ticket] Render error: {error!r}")
+            if isinstance(error, BrokenProcessPool):
+                discard_render_pool(pool)
+            retry = retry or isinstance(error, (OSError, BrokenProcessPool))
 
-    print(f" [Ticket] Saved: {filepath}")
+        if retry:
+            settle = functools.partial(ch.basic_nack, delivery_tag=delivery_tag, requeue=True)
+        else:
+            def settle():
+                publish_ticket_ready(ch, ready)
+                ch.basic_ack(delivery_tag=delivery_tag)
+        try:
+            # pika is not thread-safe: ack from the connection thread
+            connection.add_callback_threadsafe(settle)
+        except Exception as e:
+            print(f" [Ticket] Connection lost before ack, event will be redelivered: {e}")
+
+    for future in futures:
+        future.add_done_callback(on_done)
 
 def rabbit_listener():
     print(f" [Ticket] Connecting to {RABBITMQ_HOST}...")
@@ -58,18 +169,30 @@ def rabbit_listener():
             channel = connection.channel()
 
             channel.exchange_declare(exchange=MQ_EXCHANGE_EVENTS, exchange_type='fanout')
-            queue_name = 'q_tickets_generation'
+            channel.exchange_declare(exchange=MQ_EXCHANGE_TICKETS, exchange_type='fanout')
+            queue_name = MQ_QUEUE_TICKETS
             channel.queue_declare(queue=queue_name, durable=True)
-            channel.queue_bind(exchange=MQ_EXCHANGE_EVENTS, queue=queue_name)
+            # Older deployments bound this queue to the payment events; unbinding is a no-op otherwise
+            channel.queue_unbind(queue=queue_name, exchange=MQ_EXCHANGE_EVENTS)
 
             def callback(ch, method, properties, body):
                 try:
                     data = json.loads(body)
-                    generate_ticket(data)
+                    # One ticket per seat of the order
+                    tickets, futures, pool = submit_tickets(data)
                 except Exception as ex:
                     print(f" [Ticket] Process error: {ex}")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+                    tickets, futures, pool = [], [], None
 
+                if futures:
+                    settle_when_done(connection, ch, method.delivery_tag, tickets, futures, pool)
+                else:
+                    # Lazy mode: downloadable as soon as the event is stored
+                    publish_ticket_ready(ch, tickets)
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+            # Backpressure: at most TICKET_MAX_IN_FLIGHT events are unacked at once
+            channel.basic_qos(prefetch_count=TICKET_MAX_IN_FLIGHT)
             channel.basic_consume(queue=queue_name, on_message_callback=callback)
             print(" [Ticket] Listening...")
             channel.start_consuming()
@@ -80,11 +203,128 @@ def rabbit_listener():
             print(f" [Ticket] Error: {e}, retrying in 5s...")
             time.sleep(5)
 
-threading.Thread(target=rabbit_listener, daemon=True).start()
+# Single-flight for on-demand renders: file name -> (pool, render future)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def render_on_demand(filename, render, data, path):
+    """Render path in the pool, once per file name however many requests wait for it.
+
+    Raises FutureTimeoutError or BrokenProcessPool; a render that timed out keeps
+    running and later requests wait on it instead of starting another.
+    """
+    with _inflight_lock:
+        entry = _inflight.get(filename)
+        if entry is None:
+            print(f" [Ticket] Rendering {filename} on demand...")
+            pool = get_render_pool()
+            try:
+                future = pool.submit(render, data, path)
+            except BrokenProcessPool:
+                discard_render_pool(pool)
+                raise
+            entry = _inflight[filename] = (pool, future)
+            future.add_done_callback(lambda done, key=filename: _finish_render(key, done))
+    pool, future = entry
+    try:
+        future.result(timeout=TICKET_RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        discard_render_pool(pool)
+        raise
+
+def _finish_render(filename, future):
+    with _inflight_lock:
+        if _inflight.get(filename, (None, None))[1] is future:
+            del _inflight[filename]
+
+def start_cache_evictor():
+    def loop():
+        while True:
+            time.sleep(TICKET_CACHE_SWEEP_INTERVAL)
+            try:
+                evicted = evict_cache()
+                if evicted:
+                    print(f" [Ticket] Evicted {evicted} cached PDFs")
+            except Exception as e:
+                print(f" [Ticket] Cache eviction error: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
+
+@functools.lru_cache(maxsize=4096)
+def _file_etag(path, inode, mtime_ns, size):
+    # touch() only moves atime, so these stay fixed until the file is rendered again
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:32]
+
+def serve_pdf(path, download_name):
+    stat = os.stat(path)
+    etag = _file_etag(path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    if TICKET_SENDFILE_MODE == "x-accel":
+        # nginx sends the bytes and answers Range itself; 304s are still answered here
+        response = Response(mimetype="application/pdf")
+        response.headers["X-Accel-Redirect"] = f"{TICKET_ACCEL_PREFIX}/{os.path.relpath(path, TICKETS_DIR)}"
+        response.headers["Content-Disposition"] = f"inline; filename={download_name}"
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        response = send_file(path, mimetype="application/pdf", download_name=download_name,
+                             etag=etag, conditional=True)
+
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = TICKET_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+@app.get("/tickets/status")
+def tickets_status():
+    # ?ids=a,b,c -> {"a": "READY", "b": "PENDING", ...}: one call per page instead of probing every PDF
+    ids = [res_id for res_id in request.args.get("ids", "").split(",") if res_id]
+    if len(ids) > TICKET_STATUS_MAX_IDS:
+        return jsonify({"ok": False, "error": f"At most {TICKET_STATUS_MAX_IDS} ids per request"}), 400
+    if not all(RESERVATION_ID_PATTERN.match(res_id) for res_id in ids):
+        return jsonify({"ok": False, "error": "Invalid reservation id"}), 400
+
+    data = {res_id: "READY" if is_downloadable(res_id) else "PENDING" for res_id in ids}
+    return jsonify({"ok": True, "data": data})
 
 @app.route("/tickets/<filename>")
 def get_ticket(filename):
-    return send_from_directory(TICKETS_DIR, filename)
+    # ticket_{id}.pdf: one seat. order_{id}.pdf: every seat of the order whose first reservation is {id}
+    parsed = parse_filename(filename)
+    if parsed is None:
+        abort(404)
+    kind, res_id = parsed
+
+    path = pdf_path(res_id) if kind == "ticket" else order_pdf_path(res_id)
+    if os.path.exists(path):
+        touch(path)
+    elif kind == "ticket" and os.path.exists(legacy_pdf_path(res_id)):
+        path = legacy_pdf_path(res_id)
+    else:
+        data = load_event(res_id)
+        if data is None:
+            abort(404)
+        if kind == "order" and (data.get("reservation_ids") or [res_id])[0] != res_id:
+            # Orders are only addressed by their first reservation: one cached PDF per order
+            abort(404)
+        try:
+            if kind == "ticket":
+                render_on_demand(filename, render_ticket, data, path)
+            else:
+                tickets = [load_event(ticket["reservation_id"]) or ticket for ticket in split_tickets(data)]
+                render_on_demand(filename, render_order, tickets, path)
+        except (FutureTimeoutError, BrokenProcessPool) as e:
+            print(f" [Ticket] On-demand render of {filename} failed: {e!r}")
+            return (jsonify({"ok": False, "error": "Ticket is being generated, retry shortly"}), 503,
+                    {"Retry-After": str(TICKET_RENDER_RETRY_AFTER)})
+
+    return serve_pdf(path, filename)
 
 if __name__ == "__main__":
+    # Started here, not at import: render processes re-import this module
+    threading.Thread(target=rabbit_listener, daemon=True).start()
+    start_cache_evictor()
     app.run(host="0.0.0.0", port=5003)
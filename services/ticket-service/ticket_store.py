@@ -0,0 +1,101 @@
+import os
+import re
+import json
+import time
+import hashlib
+from ticket_render import ticket_filename, order_filename, write_durably
+
+# Layout under TICKETS_DIR, sharded two levels deep by a hash of the reservation id:
+#   pdf/ab/cd/ticket_{id}.pdf    rendered tickets, an LRU cache bounded by size and age
+#   pdf/ab/cd/order_{id}.pdf     every seat of the order {id} in one multi-page PDF, same cache
+#   events/ab/cd/{id}.json       PAID event data, enough to render the ticket again
+# Tickets rendered before the sharded layout stay readable at ticket_{id}.pdf.
+TICKETS_DIR = os.getenv("TICKETS_DIR", "/app/tickets")
+PDF_DIR = os.path.join(TICKETS_DIR, "pdf")
+EVENTS_DIR = os.path.join(TICKETS_DIR, "events")
+
+TICKET_CACHE_MAX_MB = int(os.getenv("TICKET_CACHE_MAX_MB", "1024"))
+TICKET_CACHE_MAX_AGE_HOURS = int(os.getenv("TICKET_CACHE_MAX_AGE_HOURS", str(7 * 24)))
+
+RESERVATION_ID = r"[A-Za-z0-9-]{1,64}"
+RESERVATION_ID_PATTERN = re.compile(rf"^{RESERVATION_ID}$")
+FILENAME_PATTERN = re.compile(rf"^(ticket|order)_({RESERVATION_ID})\.pdf$")
+
+def _shard(root, res_id, name):
+    digest = hashlib.sha1(res_id.encode()).hexdigest()
+    return os.path.join(root, digest[:2], digest[2:4], name)
+
+def parse_filename(filename):
+    """("ticket" or "order", reservation id) for a valid download name, else None."""
+    match = FILENAME_PATTERN.match(filename)
+    return (match.group(1), match.group(2)) if match else None
+
+def pdf_path(res_id):
+    return _shard(PDF_DIR, res_id, ticket_filename(res_id))
+
+def order_pdf_path(res_id):
+    return _shard(PDF_DIR, res_id, order_filename(res_id))
+
+def legacy_pdf_path(res_id):
+    return os.path.join(TICKETS_DIR, ticket_filename(res_id))
+
+def event_path(res_id):
+    return _shard(EVENTS_DIR, res_id, f"{res_id}.json")
+
+def save_event(data):
+    write_durably(event_path(data["reservation_id"]), json.dumps(data).encode())
+
+def load_event(res_id):
+    try:
+        with open(event_path(res_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def is_downloadable(res_id):
+    # A stored event is enough: a missing PDF is rendered on the first download
+    return os.path.exists(event_path(res_id)) or os.path.exists(legacy_pdf_path(res_id))
+
+def touch(path):
+    # Last access for the LRU goes in atime, set explicitly (relatime/noatime only skip the
+    # automatic updates). mtime is left alone: it marks when the content was written
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except OSError:
+        pass
+
+def evict_cache(now=None, max_bytes=TICKET_CACHE_MAX_MB * 1024 * 1024,
+                max_age=TICKET_CACHE_MAX_AGE_HOURS * 3600):
+    """Delete least recently used PDFs until the cache is under max_bytes and none is older than max_age.
+
+    Only tickets that can be rendered again (event data on disk) are evicted. Returns the count.
+    """
+    now = time.time() if now is None else now
+    entries = []
+    for dirpath, _, filenames in os.walk(PDF_DIR):
+        for name in filenames:
+            if not name.endswith(".pdf"):
+                continue # in-progress temp files
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_atime, st.st_size, path, name))
+
+    entries.sort()
+    total = sum(size for _, size, _, _ in entries)
+    evicted = 0
+    for atime, size, path, name in entries:
+        if total <= max_bytes and now - atime <= max_age:
+            break
+        parsed = parse_filename(name)
+        if parsed is None or not os.path.exists(event_path(parsed[1])):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    return evicted
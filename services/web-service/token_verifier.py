@@ -0,0 +1,198 @@
+# Shared by auth-service, movies-service and web-service: keep the copies identical.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+import jwt
+import requests
+
+class _Refresh:
+    # One JWKS fetch in flight; callers that arrive meanwhile wait on it and share its result
+    def __init__(self):
+        self.done = threading.Event()
+        self.loaded = False
+
+class JwksManager:
+    """JWKS cache kept fresh by a background thread, so request threads never wait on Keycloak.
+
+    Concurrent refreshes collapse into a single fetch, a failed refresh keeps the
+    last good key set, and force_refresh() (for an unknown kid) is rate limited:
+    inside the window it joins a refresh already in flight instead of failing.
+    Only the very first load blocks callers.
+    """
+
+    def __init__(self, url: str, ttl: float = 60.0, timeout: float = 10.0,
+                 retry_interval: float = 5.0, min_forced_interval: float = 10.0):
+        self._url = url
+        self._ttl = ttl
+        self._timeout = timeout
+        self._retry_interval = retry_interval
+        self._min_forced_interval = min_forced_interval
+
+        self._lock = threading.Lock()
+        self._jwks: dict[str, Any] | None = None
+        self._inflight: _Refresh | None = None
+        self._last_forced = 0.0
+        self._refresher: threading.Thread | None = None
+
+    def _fetch(self) -> dict[str, Any]:
+        resp = requests.get(self._url, timeout=self._timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def refresh(self) -> bool:
+        """Fetch the key set, or wait for the fetch already in flight. True if new keys were loaded."""
+        with self._lock:
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = _Refresh()
+
+        if not leader:
+            return self._join(inflight)
+
+        try:
+            jwks = self._fetch()
+            with self._lock:
+                self._jwks = jwks
+            inflight.loaded = True
+        except Exception as exc:
+            print(f"[JWKS] Refresh failed, keeping last good key set: {exc}", flush=True)
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.done.set()
+        return inflight.loaded
+
+    def _join(self, inflight: _Refresh) -> bool:
+        inflight.done.wait(self._timeout)
+        return inflight.loaded
+
+    def force_refresh(self) -> bool:
+        with self._lock:
+            now = time.time()
+            if now - self._last_forced < self._min_forced_interval:
+                # Rate limited: share a refresh already running (e.g. forced by another
+                # request with the same new kid) rather than reporting failure
+                inflight = self._inflight
+                if inflight is None:
+                    return False
+            else:
+                self._last_forced = now
+                inflight = None
+        if inflight is not None:
+            return self._join(inflight)
+        return self.refresh()
+
+    def _run_refresher(self) -> None:
+        ok = True
+        while True:
+            # Refresh ahead of expiry; retry sooner while Keycloak is failing
+            time.sleep(self._ttl * 0.8 if ok else self._retry_interval)
+            ok = self.refresh()
+
+    def _ensure_refresher(self) -> None:
+        # Started lazily so it also exists in worker processes forked after import
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        with self._lock:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._run_refresher, daemon=True)
+                self._refresher.start()
+
+    def get(self) -> dict[str, Any]:
+        self._ensure_refresher()
+        jwks = self._jwks
+        if jwks is None:
+            self.refresh()
+            jwks = self._jwks
+            if jwks is None:
+                raise RuntimeError("JWKS unavailable")
+        return jwks
+
+class TokenVerifier:
+    """RS256 access-token verification with parsed JWKs cached by kid and an LRU of verified claims.
+
+    A claims entry lives until the token's own `exp`, so a cache hit never accepts
+    a token that a full verification would reject as expired.
+    """
+
+    def __init__(self, fetch_jwks: Callable[[], dict[str, Any]], max_tokens: int = 10000,
+                 refresh_jwks: Callable[[], bool] | None = None):
+        self._fetch_jwks = fetch_jwks
+        self._refresh_jwks = refresh_jwks
+        self._max_tokens = max_tokens
+        self._lock = threading.Lock()
+
+        self._jwks: dict[str, Any] | None = None
+        self._keys: dict[str, Any] = {}
+        self._claims: OrderedDict[bytes, tuple[float, dict[str, Any]]] = OrderedDict()
+
+    def _get_key(self, kid: str) -> Any:
+        jwks = self._fetch_jwks()
+        with self._lock:
+            # A refreshed key set invalidates every parsed key
+            if jwks is not self._jwks:
+                self._jwks = jwks
+                self._keys = {}
+
+            key = self._keys.get(kid)
+            if key is None:
+                for jwk in jwks.get("keys", []):
+                    if jwk.get("kid") == kid:
+                        key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
+                        self._keys[kid] = key
+                        break
+            return key
+
+    def _cached_claims(self, digest: bytes) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._claims.get(digest)
+            if entry is None:
+                return None
+            expires_at, claims = entry
+            if time.time() >= expires_at:
+                del self._claims[digest]
+                return None
+            self._claims.move_to_end(digest)
+            return dict(claims)
+
+    def _store_claims(self, digest: bytes, claims: dict[str, Any]) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._claims[digest] = (float(exp), claims)
+            self._claims.move_to_end(digest)
+            while len(self._claims) > self._max_tokens:
+                self._claims.popitem(last=False)
+
+    def verify(self, access_token: str) -> dict[str, Any]:
+        digest = hashlib.sha256(access_token.encode()).digest()
+        claims = self._cached_claims(digest)
+        if claims is not None:
+            return claims
+
+        unverified_header = jwt.get_unverified_header(access_token)
+        kid = unverified_header.get("kid")
+        if not kid:
+            raise ValueError("JWT missing kid")
+
+        key = self._get_key(kid)
+        if key is None and self._refresh_jwks is not None:
+            # Unknown kid: Keycloak may have rotated keys since the last refresh
+            self._refresh_jwks()
+            key = self._get_key(kid)
+        if key is None:
+            raise ValueError("No matching JWK for kid")
+
+        options = {
+            "verify_signature": True,
+            "verify_exp": True,
+            "verify_aud": False,
+        }
+
+        claims = jwt.decode(access_token, key=key, algorithms=["RS256"], options=options)
+        self._store_claims(digest, claims)
+        return dict(claims)
@@ -1,8 +1,8 @@
 import os
 import time
 from typing import Any
-import jwt
 import requests
+from token_verifier import JwksManager, TokenVerifier
 
 def _get_env(name: str) -> str:
     value = os.getenv(name)
@@ -14,6 +14,8 @@ def _get_env(name: str) -> str:
 
 AUTH_SERVICE_URL = _get_env("EXTERNAL_PUBLIC_AUTH_URL").rstrip("/")
 TICKET_SERVICE_URL = _get_env("EXTERNAL_PUBLIC_TICKET_URL").rstrip("/")
+# Service-to-service address, for the ticket status lookups
+TICKET_SERVICE_INTERNAL_URL = os.getenv("TICKET_SERVICE_INTERNAL_URL", "http://ticket-service:5003").rstrip("/")
 MOVIES_SERVICE_URL = _get_env("MOVIES_SERVICE_URL").rstrip("/")
 
 KEYCLOAK_INTERNAL = _get_env("KEYCLOAK_URL_INTERNAL").rstrip("/")
@@ -24,9 +26,11 @@ PORT = _get_env("PORT")
 FLASK_SECRET_KEY = _get_env("FLASK_SECRET_KEY")
 
 JWKS_URL = f"{KEYCLOAK_INTERNAL}/realms/{REALM}/protocol/openid-connect/certs"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+JWKS_TTL = float(os.getenv("JWKS_TTL", "60"))
 
-_jwks_cache: dict[str, Any] | None = None
-_jwks_cache_expires_at: float = 0.0
+# Refreshed in the background; request threads never fetch it themselves
+_jwks = JwksManager(JWKS_URL, ttl=JWKS_TTL)
 
 def wait_for_keycloak():
     url = f"{KEYCLOAK_INTERNAL}/health/ready"
@@ -42,46 +46,11 @@ def wait_for_keycloak():
         time.sleep(2)
     raise RuntimeError("Keycloak not ready after 300 seconds")
 
-def _fetch_jwks() -> dict[str, Any]:
-    global _jwks_cache, _jwks_cache_expires_at
-    now = time.time()
-    if _jwks_cache and now < _jwks_cache_expires_at:
-        return _jwks_cache
-
-    resp = requests.get(JWKS_URL, timeout=10)
-    resp.raise_for_status()
-    _jwks_cache = resp.json()
-    _jwks_cache_expires_at = now + 60
-    return _jwks_cache
+# Parsed keys by kid + verified claims until exp, see token_verifier.py
+_verifier = TokenVerifier(_jwks.get, max_tokens=TOKEN_CACHE_SIZE, refresh_jwks=_jwks.force_refresh)
 
 def decode_and_verify_access_token(access_token: str) -> dict[str, Any]:
-    jwks = _fetch_jwks()
-    unverified_header = jwt.get_unverified_header(access_token)
-    kid = unverified_header.get("kid")
-    if not kid:
-        raise ValueError("JWT missing kid")
-
-    key = None
-    for jwk in jwks.get("keys", []):
-        if jwk.get("kid") == kid:
-            key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk)
-            break
-    if key is None:
-        raise ValueError("No matching JWK for kid")
-
-    options = {
-        "verify_signature": True,
-        "verify_exp": True,
-        "verify_aud": False,
-    }
-
-    kwargs: dict[str, Any] = {
-        "key": key,
-        "algorithms": ["RS256"],
-        "options": options,
-    }
-
-    return jwt.decode(access_token, **kwargs)
+    return _verifier.verify(access_token)
 
 def extract_roles(decoded_token: dict[str, Any]) -> set[str]:
     resource_access = decoded_token.get("resource_access") or {}
@@ -1,12 +1,13 @@
 
 import os
 import requests
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 from flask import Flask, render_template, request, redirect, url_for, flash
 
 from utils import (
     decode_and_verify_access_token, extract_roles, wait_for_keycloak,
-    AUTH_SERVICE_URL, MOVIES_SERVICE_URL, TICKET_SERVICE_URL, PORT, FLASK_SECRET_KEY
+    AUTH_SERVICE_URL, MOVIES_SERVICE_URL, TICKET_SERVICE_URL, TICKET_SERVICE_INTERNAL_URL, PORT, FLASK_SECRET_KEY
 )
 
 load_dotenv()
@@ -33,7 +34,8 @@ def get_user_info():
     return user, roles, access_token
 
 def backend_request(method, endpoint, json=None):
-    _, _, token = get_user_info()
+    # Just forward the cookie; the movies service verifies it anyway
+    token = request.cookies.get("access_token")
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
@@ -58,6 +60,18 @@ def backend_request(method, endpoint, json=None):
     except Exception as e:
         return {"ok": False, "error": str(e)}, 500
 
+def ticket_statuses(reservation_ids):
+    # One batch lookup per page; if the ticket service is down the tickets just show as preparing
+    if not reservation_ids:
+        return {}
+    try:
+        resp = requests.get(f"{TICKET_SERVICE_INTERNAL_URL}/tickets/status",
+                            params={"ids": ",".join(reservation_ids)}, timeout=2)
+        return resp.json().get("data", {}) if resp.status_code == 200 else {}
+    except Exception as e:
+        print(f"[TICKETS] Status lookup failed: {e}", flush=True)
+        return {}
+
 @app.get("/")
 def home():
     user, roles, _ = get_user_info()
@@ -189,7 +203,8 @@ def add_room():
 def seat_map(mid, sid):
     user, roles, _ = get_user_info()
 
-    resp, code = backend_request("GET", f"/movies/{mid}/screenings/{sid}/seats")
+    # Compact bitset; decoded in the browser, never expanded into a matrix here
+    resp, code = backend_request("GET", f"/movies/{mid}/screenings/{sid}/seats?format=bitset")
     if code != 200:
         return f"Error: {resp.get('error')}", code
 
@@ -209,16 +224,33 @@ def proxy_reservation():
     resp, code = backend_request("POST", "/reservations", json=payload)
     return resp, code
 
+@app.route("/reservations/batch", methods=["POST"])
+def proxy_reservation_batch():
+    user, roles, _ = get_user_info()
+    if not user:
+        return {"error": "Not authenticated"}, 401
+
+    payload = request.json
+    resp, code = backend_request("POST", "/reservations/batch", json=payload)
+    return resp, code
+
 @app.route("/myprofile")
 def my_profile():
     user, roles, _ = get_user_info()
     if not user:
         return redirect(f"{AUTH_SERVICE_URL}/auth/signin")
 
-    resp, code = backend_request("GET", "/reservations/me")
+    # One page at a time; the backend hands back an opaque cursor for the next one
+    cursor = request.args.get("cursor")
+    endpoint = f"/reservations/me?{urlencode({'cursor': cursor})}" if cursor else "/reservations/me"
+    resp, code = backend_request("GET", endpoint)
     reservations = resp.get("data", []) if code == 200 else []
+    next_cursor = resp.get("next_cursor") if code == 200 else None
+    tickets = ticket_statuses([str(r["id"]) for r in reservations if str(r.get("status")).upper() == "PAID"])
 
-    return render_template("my_profile.html", user=user, roles=roles, reservations=reservations, auth_service_url=AUTH_SERVICE_URL, ticket_service_url=TICKET_SERVICE_URL)
+    return render_template("my_profile.html", user=user, roles=roles, reservations=reservations,
+                           tickets=tickets, next_cursor=next_cursor, is_first_page=not cursor,
+                           auth_service_url=AUTH_SERVICE_URL, ticket_service_url=TICKET_SERVICE_URL)
 
 @app.get("/health")
 def health():